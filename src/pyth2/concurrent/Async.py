@@ -5,15 +5,188 @@ Created on 2016/03/03
 '''
 from pyth2.deco import Decorators
 from pyth2.concurrent import Concurrent
+from pyth2.concurrent.Timer import monotonic
+import threading
 import time
 
 DEFAULT_EXECUTOR = Concurrent.Executor(True, None)
 
-class AsyncProxy(object):
+DEFAULT_GROUP_LIMIT = 32 # maximum number of concurrent calls of AsyncGroup
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter.
+    Tokens are refilled at rate tokens per second up to burst tokens. Callers reserve tokens in order, and sleep until their tokens are refilled.
+    """
+    
+    def __init__(self, rate, burst = None):
+        """
+        Initializer
+        
+        @param rate: tokens per second
+        @param burst: capacity of the bucket(maximum number of calls at once after idle), or 1 if None
+        """
+        if rate <= 0:
+            raise ValueError("Rate must be more than 0: %f" % rate)
+        burst = 1 if burst is None else burst
+        if burst < 1:
+            raise ValueError("Burst must be 1 or more: %f" % burst)
+        self.__rate = float(rate)
+        self.__burst = float(burst)
+        self.__tokens = self.__burst
+        self.__updatedAt = monotonic()
+        self.__lock = threading.Lock()
+    
+    @property
+    def rate(self):
+        return self.__rate
+    
+    @property
+    def burst(self):
+        return self.__burst
+    
+    def __refill(self):
+        """
+        (internal private) Refills tokens by elapsed time. The caller must hold the lock.
+        """
+        now = monotonic()
+        self.__tokens = min(self.__burst, self.__tokens + (now - self.__updatedAt) * self.__rate)
+        self.__updatedAt = now
+    
+    def tryAcquire(self, tokens = 1):
+        """
+        Takes tokens without blocking
+        
+        @return: True if taken, False if the bucket does not have enough tokens
+        """
+        with self.__lock:
+            self.__refill()
+            if self.__tokens < tokens:
+                return False
+            self.__tokens -= tokens
+            return True
+    
+    def acquire(self, tokens = 1):
+        """
+        Takes tokens, blocks until the tokens are refilled
+        
+        @return: seconds of waiting
+        """
+        with self.__lock:
+            self.__refill()
+            self.__tokens -= tokens # reserves tokens, later callers wait for this reservation too
+            deficit = -self.__tokens
+        if deficit <= 0:
+            return 0.0
+        wait = deficit / self.__rate
+        time.sleep(wait)
+        return wait
+
+def _throttled(bucket, function, *args, **kwds):
+    """
+    (internal) Performs a function after taking a token of the bucket
+    """
+    bucket.acquire()
+    return function(*args, **kwds)
+
+class AsyncGroup(object):
+    """
+    A group of asynchronous functions which shares the concurrency limit and the rate limit.
+    Calls are performed by a pool of at most limit threads(works as a semaphore of the group), excess calls are queued instead of spawning threads.
+    If rate is given, each call takes a token of the token bucket which is shared in the group before the call.
+    """
+    
+    def __init__(self, limit = DEFAULT_GROUP_LIMIT, rate = None, burst = None, queueCapacity = None):
+        """
+        Initializer
+        
+        @param limit: maximum number of concurrent calls
+        @param rate: maximum calls per second, or None for unlimited
+        @param burst: maximum calls at once after idle(capacity of the token bucket), or 1 if None
+        @param queueCapacity: maximum number of queued calls(callers are blocked if full), or None for unbounded queue
+        """
+        if int(limit) <= 0:
+            raise ValueError("Limit must be more than 0: %d" % limit)
+        if rate is None and not burst is None:
+            raise ValueError("Burst requires rate")
+        self.__limit = int(limit)
+        self.__bucket = TokenBucket(rate, burst) if not rate is None else None
+        self.__executor = Concurrent.Executor(True, self.__limit, queueCapacity = queueCapacity)
+    
+    @property
+    def limit(self):
+        return self.__limit
+    
+    @property
+    def bucket(self):
+        """
+        TokenBucket of this group, or None if not rate limited
+        """
+        return self.__bucket
     
-    def __init__(self, annotatee, group = None):
+    @property
+    def executor(self):
+        return self.__executor
+    
+    def matches(self, limit, rate, burst):
+        """
+        Returns True if this group has the limits(None means unspecified)
+        """
+        return ((limit is None or int(limit) == self.__limit) and
+                (rate is None or not self.__bucket is None and float(rate) == self.__bucket.rate) and
+                (burst is None or not self.__bucket is None and float(burst) == self.__bucket.burst))
+    
+    def submit(self, function, *args, **kwds):
+        """
+        Submits a call into this group
+        
+        @return: Future object
+        """
+        if self.__bucket is None:
+            return self.__executor.submit(function, *args, **kwds)
+        return self.__executor.submit(_throttled, self.__bucket, function, *args, **kwds)
+
+_groups = {} # name -> AsyncGroup
+
+_groupsLock = threading.Lock()
+
+def asyncGroup(name, limit = None, rate = None, burst = None):
+    """
+    Returns the AsyncGroup of the name, the group is created at first time
+    
+    @param limit: maximum number of concurrent calls, or DEFAULT_GROUP_LIMIT if None
+    @param rate: maximum calls per second, or None for unlimited
+    @param burst: maximum calls at once after idle
+    @raise ValueError: the group already exists with other limits
+    """
+    with _groupsLock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = AsyncGroup(limit if not limit is None else DEFAULT_GROUP_LIMIT, rate, burst)
+        elif not group.matches(limit, rate, burst):
+            raise ValueError("Async group %s already exists with other limits" % name)
+        return group
+
+class AsyncProxy(object):
+
+    def __init__(self, annotatee, group = None, limit = None, rate = None, burst = None):
+        """
+        Initializer
+        
+        @param group: an Executor, an AsyncGroup, a name of AsyncGroup(shared by functions which have the same name), or None
+        @param limit: maximum number of concurrent calls of the group
+        @param rate: maximum calls per second of the group
+        @param burst: maximum calls at once after idle of the group
+        """
+        limited = not (limit is None and rate is None and burst is None)
+        if isinstance(group, basestring):
+            group = asyncGroup(group, limit, rate, burst)
+        elif limited:
+            if not group is None:
+                raise ValueError("Limits are given with %s" % group)
+            group = AsyncGroup(limit if not limit is None else DEFAULT_GROUP_LIMIT, rate, burst) # limits of this function only
         group = group if not group is None else DEFAULT_EXECUTOR
-        if not isinstance(group, Concurrent.Executor):
+        if not isinstance(group, (Concurrent.Executor, AsyncGroup)):
             raise ValueError("%s is not Executor" % group)
         self.__func = annotatee
         self.__group = group
@@ -39,3 +212,16 @@ if __name__ == "__main__":
     print c1().decode("utf8")
     print c2()
     print hoge(1)()
+    
+    @async("downstream", limit = 4, rate = 20, burst = 5)
+    def call(n):
+        time.sleep(0.1)
+        return n
+    
+    @async("downstream")
+    def otherCall(n):
+        return -n
+    
+    t = time.time()
+    futures = [call(n) for n in xrange(50)] + [otherCall(n) for n in xrange(50)]
+    print sum(f() for f in futures), "%f sec(100 calls at 20 calls/sec)" % (time.time() - t)
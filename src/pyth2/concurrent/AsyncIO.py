@@ -0,0 +1,207 @@
+# encoding: utf-8
+'''
+Created on 2016/03/14
+
+@author: _
+
+Bridges between pyth2.concurrent and asyncio(or trollius, the backport of asyncio for Python 2).
+1) wrapFuture: waits for a pyth2 Future from coroutines without blocking a thread
+2) CoroutineExecutor: submits coroutines to an event loop and returns pyth2 Future objects
+3) awaitable: like Async.async, but the decorated function returns an asyncio Future
+'''
+import sys
+import threading
+
+from pyth2.concurrent import Async, Concurrent
+from pyth2.deco import Decorators
+
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+def _requireAsyncio():
+    """
+    (internal) Raises ImportError if neither asyncio nor trollius is available
+    """
+    if asyncio is None:
+        raise ImportError("asyncio or trollius is required")
+
+def _ensureFuture(coroutine, loop):
+    """
+    (internal) Schedules a coroutine(or passes an asyncio Future through) on the loop
+    """
+    ensureFuture = getattr(asyncio, "ensure_future", None) or getattr(asyncio, "async")
+    return ensureFuture(coroutine, loop = loop)
+
+def wrapFuture(future, loop = None):
+    """
+    Wraps a pyth2 Future into an asyncio Future of the loop, so that coroutines can wait for it(yield From(..) on trollius).
+    No thread is blocked for waiting, the results are transferred to the loop when the associated task is done.
+    Cancellation of the asyncio Future cancels the pyth2 Future.
+    
+    @param future: pyth2 Future object
+    @param loop: an event loop, or asyncio.get_event_loop() if None
+    @return: asyncio Future object
+    """
+    _requireAsyncio()
+    if not isinstance(future, Concurrent.Future):
+        raise ValueError("%s is not Future" % future)
+    loop = loop if not loop is None else asyncio.get_event_loop()
+    aioFuture = loop.create_future() if hasattr(loop, "create_future") else asyncio.Future(loop = loop)
+    
+    def _transfer(source):
+        if aioFuture.done():
+            return # cancelled by the loop side
+        result, excInfo = source.getSafe()
+        if excInfo is None:
+            aioFuture.set_result(result)
+        else:
+            aioFuture.set_exception(excInfo[1] if not excInfo[1] is None else excInfo[0]())
+    def _cancel(aioFuture):
+        if aioFuture.cancelled():
+            future.cancel()
+    aioFuture.add_done_callback(_cancel) # also keeps the pyth2 Future alive while the asyncio Future is referred
+    future.addDoneCallback(lambda source: loop.call_soon_threadsafe(_transfer, source))
+    return aioFuture
+
+class CoroutineExecutor(object):
+    """
+    Executor-compatible facade which performs coroutines on an event loop.
+    submit() returns pyth2 Future objects, so coroutines can be mixed with Task/then pipelines and blocking callers.
+    """
+    
+    def __init__(self, loop = None):
+        """
+        Initializer
+        
+        @param loop: an event loop which is run by the caller, or None to run a new event loop in a dedicated daemon thread
+        """
+        _requireAsyncio()
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self.__thread = threading.Thread(target = self.__runLoop, args = (loop,))
+            self.__thread.daemon = True
+            self.__thread.start()
+        else:
+            self.__thread = None
+        self.__loop = loop
+    
+    @property
+    def loop(self):
+        """
+        The event loop which performs coroutines
+        """
+        return self.__loop
+    
+    def submit(self, coroutine, *args, **kwds):
+        """
+        Submits a coroutine into the event loop.
+        The coroutine is started in the loop thread, cancellation of the returned Future cancels the coroutine.
+        
+        @param coroutine: a coroutine object, or a coroutine function with args and kwds
+        @return: Future object
+        """
+        if callable(coroutine):
+            task = Concurrent.Task(coroutine, *args, **kwds)
+        elif asyncio.iscoroutine(coroutine) or isinstance(coroutine, asyncio.Future):
+            if args or kwds:
+                raise ValueError("Arguments are given to a coroutine object")
+            task = Concurrent.Task(lambda: coroutine)
+        else:
+            raise ValueError("%s is not coroutine" % coroutine)
+        future = Concurrent.Future(task)
+        task._setFuture(future, True) # the returned Future may be referred by nothing but continuations
+        self.__loop.call_soon_threadsafe(self.__start, task, future)
+        return future
+    
+    def map(self, function, iterable):
+        """
+        Applies a coroutine function to all items concurrently
+        
+        @return: generator of results in order of the iterable
+        """
+        futures = [self.submit(function, item) for item in iterable]
+        return (future.get() for future in futures)
+    
+    def shutdown(self):
+        """
+        Stops and closes the event loop if it is run by this executor
+        """
+        if not self.__thread is None:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__thread.join()
+            self.__loop.close()
+    
+    def __runLoop(self, loop):
+        """
+        (internal private) Runs the event loop in the dedicated thread
+        """
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+    
+    def __start(self, task, future):
+        """
+        (internal private) Starts a coroutine in the loop thread
+        """
+        if task.isDone():
+            return # cancelled before start
+        try:
+            aioTask = _ensureFuture(task.function(*task.args, **task.kwds), self.__loop)
+        except:
+            task._complete((None, sys.exc_info()))
+            sys.exc_clear()
+            return
+        def _finish(aioTask):
+            if aioTask.cancelled():
+                task._complete((None, (Concurrent.TaskCancelledError, Concurrent.TaskCancelledError("Coroutine is cancelled"), None)))
+            elif not aioTask.exception() is None:
+                e = aioTask.exception()
+                task._complete((None, (type(e), e, None)))
+            else:
+                task._complete((aioTask.result(), None))
+        aioTask.add_done_callback(_finish)
+        future.addDoneCallback(lambda f: f.cancelled and self.__loop.call_soon_threadsafe(aioTask.cancel))
+
+class AwaitableProxy(Async.AsyncProxy):
+
+    def __init__(self, annotatee, group = None, loop = None):
+        super(AwaitableProxy, self).__init__(annotatee, group)
+        self.__loop = loop
+    
+    def __call__(self, *args, **kwds):
+        return wrapFuture(super(AwaitableProxy, self).__call__(*args, **kwds), self.__loop)
+
+awaitable = Decorators.ConsProxy(AwaitableProxy)
+
+if __name__ == "__main__":
+    import time
+    
+    @awaitable()
+    def blockingIO(n):
+        time.sleep(0.5)
+        return n * n
+    
+    @asyncio.coroutine
+    def gather(count):
+        results = yield asyncio.From(asyncio.gather(*[blockingIO(n) for n in xrange(count)]))
+        raise asyncio.Return(results)
+    
+    loop = asyncio.get_event_loop()
+    t = time.time()
+    print loop.run_until_complete(gather(8)), time.time() - t
+    
+    @asyncio.coroutine
+    def delayed(n):
+        yield asyncio.From(asyncio.sleep(0.5))
+        raise asyncio.Return(n + 1)
+    
+    executor = CoroutineExecutor()
+    t = time.time()
+    print list(executor.map(delayed, xrange(1000))), time.time() - t
+    print executor.submit(delayed, 1).thenAsync(lambda n: n * 10).get()
+    executor.shutdown()
@@ -0,0 +1,330 @@
+# encoding: utf-8
+'''
+Created on 2016/03/10
+
+@author: _
+
+Benchmarks for pyth2.concurrent.
+Run as "python -m pyth2.concurrent.Benchmarks [benchmark name ...]", all benchmarks are run if no name is given.
+'''
+import math
+import random
+import sys
+import threading
+import time
+
+from pyth2.concurrent.Concurrent import Executor, Task, Future, CancellationTokenSource, StepwiseTask, TimeSlicedTask, TaskGroup, TaskGroupError, WORKER_THREAD_LIFETIME
+from pyth2.concurrent.Metrics import ExecutorMetrics
+from pyth2.concurrent.Synchronized import synchronized, readLocked, writeLocked, striped, ReadWriteLock
+from pyth2.concurrent.Timer import ContinuousTimer, TimerWheel
+
+
+def _noop():
+    pass
+
+def _skewed(duration):
+    if duration > 0:
+        time.sleep(duration)
+
+def _drain(futures):
+    for f in futures:
+        f.getSafe()
+
+def _measure(executor, submissions):
+    """
+    Submits all submissions(pairs of (callable, args)) into the executor and waits for all of them.
+    
+    @return: elapsed time in seconds
+    """
+    begin = time.time()
+    futures = [executor.submit(func, *args) for func, args in submissions]
+    _drain(futures)
+    return time.time() - begin
+
+def benchmarkWorkStealing(taskCount = 1000000, skewedTaskCount = 2000, poolSize = 8):
+    """
+    Compares the central dispatcher path with the work-stealing path.
+    1) taskCount no-op tasks
+    2) skewedTaskCount tasks whose durations are heavy-tailed(most tasks are no-op, few tasks sleep up to 50 msec)
+    """
+    rnd = random.Random(0)
+    durations = [min(0.05, rnd.paretovariate(1.2) / 1000.0) if rnd.random() < 0.1 else 0.0 for _ in xrange(skewedTaskCount)]
+    cases = (
+             ("no-op x %d" % taskCount, [(_noop, ())] * taskCount),
+             ("skewed x %d" % skewedTaskCount, [(_skewed, (d,)) for d in durations]))
+    for caseName, submissions in cases:
+        for mode, workStealing in (("central", False), ("stealing", True)):
+            executor = Executor(True, poolSize, workStealing = workStealing)
+            elapsed = _measure(executor, submissions)
+            print "%-20s %-8s %8.3f sec %12.1f tasks/sec" % (caseName, mode, elapsed, len(submissions) / elapsed)
+
+def _percentile(values, ratio):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+def benchmarkPriority(poolSize = 4, backgroundTaskCount = 4000, urgentTaskCount = 200, taskDuration = 0.002):
+    """
+    Measures queueing latency of high priority tasks under a saturated pool.
+    The pool is flooded by backgroundTaskCount low priority tasks, and urgentTaskCount high priority tasks are submitted meanwhile.
+    """
+    for mode, prioritized in (("fifo", False), ("prioritized", True)):
+        executor = Executor(True, poolSize, prioritized = prioritized)
+        background = [executor.submitWith(_skewed, (taskDuration,), priority = 0) for _ in xrange(backgroundTaskCount)]
+        latencies = []
+        def urgent(submitted):
+            latencies.append(time.time() - submitted)
+        urgents = []
+        for _ in xrange(urgentTaskCount):
+            urgents.append(executor.submitWith(urgent, (time.time(),), priority = 10))
+            time.sleep(taskDuration)
+        _drain(urgents)
+        _drain(background)
+        print "%-12s urgent latency p50 %8.2f msec  p99 %8.2f msec  max %8.2f msec" % (mode, _percentile(latencies, 0.5) * 1000, _percentile(latencies, 0.99) * 1000, max(latencies) * 1000)
+
+def _record(timer, fireTimes, threads):
+    fireTimes.append(time.time())
+    threads.add(threading.currentThread().ident)
+
+def _timerStats(fireTimes, period):
+    """
+    Returns a pair of (drift, jitter) in seconds.
+    Drift is lateness of the last tick from the ideal schedule which begins at the first tick, jitter is standard deviation of intervals.
+    """
+    intervals = [b - a for a, b in zip(fireTimes, fireTimes[1:])]
+    mean = sum(intervals) / len(intervals)
+    jitter = math.sqrt(sum((i - mean) ** 2 for i in intervals) / len(intervals))
+    drift = fireTimes[-1] - (fireTimes[0] + (len(fireTimes) - 1) * period)
+    return drift, jitter
+
+def benchmarkTimers(period = 0.01, duration = 5.0, timerCount = 500):
+    """
+    Compares the sleep loop(ContinuousTimer, which occupies a thread per timer) with TimerWheel(one thread for all timers).
+    1) a timer of the period
+    2) timerCount timers of 10 * period
+    Threads are counted by threads which perform handlers.
+    """
+    for count, timerPeriod in ((1, period), (timerCount, period * 10)):
+        for mode in ("sleep loop", "timer wheel"):
+            threads = set()
+            fireTimes = [[] for _ in xrange(count)]
+            if mode == "sleep loop":
+                executor = Executor(True)
+                timers = [ContinuousTimer(timerPeriod, _record, times, threads) for times in fireTimes]
+                for timer in timers:
+                    executor.submit(timer)
+                time.sleep(duration)
+                for timer in timers:
+                    timer.cancel()
+            else:
+                wheel = TimerWheel(min(0.001, timerPeriod / 10))
+                for times in fireTimes:
+                    wheel.scheduleAtFixedRate(0, timerPeriod, _record, (times, threads))
+                time.sleep(duration)
+                wheel.shutdown()
+            stats = [_timerStats(times, timerPeriod) for times in fireTimes]
+            print "%5d x %5.0f msec %-12s threads %5d  drift mean %8.3f msec  jitter mean %7.3f msec  max %7.3f msec" % (
+                count, timerPeriod * 1000, mode, len(threads),
+                sum(d for d, _ in stats) / count * 1000, sum(j for _, j in stats) / count * 1000, max(j for _, j in stats) * 1000)
+
+def _runThreads(threadCount, body):
+    """
+    Runs body in threadCount threads at once
+    
+    @return: elapsed time in seconds
+    """
+    threads = [threading.Thread(target = body, args = (i,)) for i in xrange(threadCount)]
+    begin = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.time() - begin
+
+def benchmarkLocks(threadCount = 16, operationsPerThread = 200, readRatio = 0.9, keyCount = 64, holdTime = 0.0005):
+    """
+    Measures a shared cache under contention of threadCount threads.
+    Each operation holds the lock for holdTime seconds(like I/O or a C extension which releases GIL), and readRatio of operations are reads.
+    """
+    cache = {}
+    rwLock = ReadWriteLock()
+    def access(key, value = None):
+        time.sleep(holdTime)
+        if value is None:
+            return cache.get(key)
+        cache[key] = value
+    cases = (
+             ("synchronized", synchronized()(access), None),
+             ("readLocked/writeLocked", readLocked(rwLock)(access), writeLocked(rwLock)(access)),
+             ("striped", striped("key")(access), None))
+    for caseName, reader, writer in cases:
+        writer = writer or reader
+        def body(seed):
+            rnd = random.Random(seed)
+            for _ in xrange(operationsPerThread):
+                key = rnd.randrange(keyCount)
+                if rnd.random() < readRatio:
+                    reader(key)
+                else:
+                    writer(key, seed)
+        elapsed = _runThreads(threadCount, body)
+        operations = threadCount * operationsPerThread
+        print "%-24s %2d threads %8.3f sec %10.1f ops/sec" % (caseName, threadCount, elapsed, operations / elapsed)
+
+def _countSteps(steps):
+    for _ in xrange(steps):
+        yield True
+
+def benchmarkCancellation(steps = 1000000):
+    """
+    Measures per-step overhead of StepwiseTask, which checks the CancellationTokenSource after every step.
+    The cost of a cancellation check by a plain attribute is compared with a check guarded by RLock.
+    """
+    source = CancellationTokenSource()
+    lock = threading.RLock()
+    def lockedCheck():
+        with lock:
+            return source.isCancelled
+    for name, check in (("attribute check", lambda: source.isCancelled), ("RLock-guarded check", lockedCheck)):
+        begin = time.time()
+        for _ in xrange(steps):
+            check()
+        elapsed = time.time() - begin
+        print "%-24s %8.1f nsec/check" % (name, elapsed / steps * 1e9)
+    begin = time.time()
+    for _ in _countSteps(steps):
+        pass
+    bare = time.time() - begin
+    begin = time.time()
+    StepwiseTask(_countSteps, None, steps)()
+    elapsed = time.time() - begin
+    print "%-24s %8.1f nsec/step(bare generator %.1f nsec/step)" % ("StepwiseTask", elapsed / steps * 1e9, bare / steps * 1e9)
+
+def benchmarkTimeSlicing(poolSize = 2, generatorCount = 8, steps = 500000, quickTaskCount = 50):
+    """
+    Measures latency of quick tasks while generatorCount long generators run on a small pool, with and without time-slicing.
+    """
+    for mode in ("stepwise", "time-sliced"):
+        executor = Executor(True, poolSize)
+        begin = time.time()
+        if mode == "stepwise":
+            tasks = [StepwiseTask(_countSteps, None, steps) for _ in xrange(generatorCount)]
+        else:
+            tasks = [TimeSlicedTask(_countSteps, None, None, 0.005, None, steps) for _ in xrange(generatorCount)]
+        futures = [executor.submit(task) for task in tasks]
+        latencies = []
+        def quick(submitted):
+            latencies.append(time.time() - submitted)
+        quicks = []
+        for _ in xrange(quickTaskCount):
+            quicks.append(executor.submit(quick, time.time()))
+            time.sleep(0.01)
+        _drain(futures)
+        elapsed = time.time() - begin
+        _drain(quicks)
+        print "%-12s quick task latency p50 %8.2f msec  max %8.2f msec  total %8.3f sec %10.0f steps/sec" % (
+            mode, _percentile(latencies, 0.5) * 1000, max(latencies) * 1000, elapsed, sum(task.steps for task in tasks) / elapsed)
+
+def benchmarkBursts(burstCount = 3, burstSize = 64, taskDuration = 0.005, lull = WORKER_THREAD_LIFETIME + 0.5):
+    """
+    Measures queue wait of bursty workload whose lulls are longer than idle lifetime of threads.
+    On-demand threads expire in every lull, core threads(fixed or adaptive) are kept alive.
+    """
+    for mode, kwds in (("on demand", {}), ("core", {"coreSize": burstSize}), ("adaptive", {"adaptive": True})):
+        metrics = ExecutorMetrics()
+        executor = Executor(True, None, metrics = metrics, **kwds)
+        for i in xrange(burstCount):
+            if i:
+                time.sleep(lull)
+            _drain([executor.submit(_skewed, taskDuration) for _ in xrange(burstSize)])
+        wait = metrics.queueWait.snapshot()
+        print "%-10s queue wait p50 %8.3f msec  p99 %8.3f msec  threads created %4d  purged %4d" % (
+            mode, wait["p50"] * 1000, wait["p99"] * 1000, metrics.counter("threadCreated"), metrics.counter("threadPurged"))
+
+def _fanOutMember(index, failAt, steps, token, performed):
+    for i in xrange(steps):
+        if not token is None and token.isCancelled:
+            return
+        if index == failAt and i == steps // 10:
+            raise ValueError("member %d failed" % index)
+        time.sleep(0.001)
+        performed.append(1)
+
+def benchmarkTaskGroup(poolSize = 8, memberCount = 64, steps = 50):
+    """
+    Measures wasted work of a fan-out whose member fails early.
+    Isolated futures keep running until all of them are done, TaskGroup cancels the remaining members at the failure.
+    """
+    for mode in ("futures", "task group"):
+        executor = Executor(True, poolSize)
+        performed = []
+        begin = time.time()
+        if mode == "futures":
+            futures = [executor.submit(_fanOutMember, i, 0, steps, None, performed) for i in xrange(memberCount)]
+            _drain(futures)
+            failed = sum(1 for f in futures if not f.getSafe()[1] is None)
+        else:
+            try:
+                with TaskGroup(executor) as group:
+                    for i in xrange(memberCount):
+                        group.submit(_fanOutMember, i, 0, steps, group.token, performed)
+                failed = 0
+            except TaskGroupError, e:
+                failed = len(e.excInfos)
+        elapsed = time.time() - begin
+        print "%-12s failed %d  elapsed %8.3f sec  performed steps %6d of %6d" % (mode, failed, elapsed, len(performed), memberCount * steps)
+
+def benchmarkTaskOverhead(count = 200000, poolSize = 4):
+    """
+    Measures per-task overhead of tiny tasks.
+    1) creation of a pair of Task and Future
+    2) performing a Task in the caller thread
+    3) Future.get of a completed Future
+    4) submit and get through an Executor(central dispatcher with core threads, and work-stealing)
+    """
+    begin = time.time()
+    for _ in xrange(count):
+        task = Task(_noop)
+        task._setFuture(Future(task))
+    create = time.time() - begin
+    tasks = []
+    futures = []
+    for _ in xrange(count):
+        task = Task(_noop)
+        future = Future(task)
+        task._setFuture(future)
+        tasks.append(task)
+        futures.append(future)
+    begin = time.time()
+    for task in tasks:
+        task()
+    perform = time.time() - begin
+    begin = time.time()
+    for future in futures:
+        future.get()
+    get = time.time() - begin
+    del tasks, futures
+    results = [("create Task+Future", create), ("perform Task", perform), ("get completed Future", get)]
+    for mode, kwds in (("central", {"coreSize": poolSize}), ("stealing", {"workStealing": True})):
+        executor = Executor(True, poolSize, **kwds)
+        begin = time.time()
+        _drain(executor.submitMany(_noop, [()] * count))
+        results.append(("submit and get(%s)" % mode, time.time() - begin))
+    for name, elapsed in results:
+        print "%-28s %8.3f usec/task" % (name, elapsed / count * 1e6)
+
+BENCHMARKS = {
+              "workStealing": benchmarkWorkStealing,
+              "priority": benchmarkPriority,
+              "timers": benchmarkTimers,
+              "locks": benchmarkLocks,
+              "cancellation": benchmarkCancellation,
+              "timeSlicing": benchmarkTimeSlicing,
+              "bursts": benchmarkBursts,
+              "taskGroup": benchmarkTaskGroup,
+              "taskOverhead": benchmarkTaskOverhead,
+              }
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or sorted(BENCHMARKS):
+        print "== %s" % name
+        BENCHMARKS[name]()
@@ -6,37 +6,106 @@ Created on 2016/02/25
 '''
 
 import Queue
+import collections
+import heapq
+import itertools
+import multiprocessing
 import random
 import sys
 import threading
 import time
 import weakref
 
+from pyth2.enum.SafeEnum import enumOf
+
 
 WORKER_THREAD_LIFETIME = 3 # seconds
 
-THREAD_SIGNAL_TRACE_ENABLED = True # True if threading.settrace hack is enabled
+DEFAULT_WORK_STEALING_POOL_SIZE = multiprocessing.cpu_count() # number of threads in work-stealing mode if poolMaxSize is None
+
+STEALING_IDLE_WAIT = 0.05 # seconds, upper bound of parking time of idle work-stealing threads
+
+THREAD_SIGNAL_TRACE_ENABLED = True # True if threading.settrace hack is enabled(running tasks can be interrupted), set False to opt out of the trace hook which slows all task code
 
 _UNUSED_QUEUE_EMPTY = Queue.Empty # Sometimes the reference to Queue.Empty is releases on process termination.
 
 ERASE_UNHANDLED_TASK_EXCEPTION_FRAME_LOCALS = False
 
+DEFAULT_MAP_LOOK_AHEAD = 32 # maximum number of chunks in flight of Executor.map
+
+DEFAULT_SUBMIT_BATCH_SIZE = 256 # number of tasks which are enqueued at once by Executor.submitMany
+
+DEFAULT_PRIORITY_AGING = 1.0 # seconds, a queued task overtakes newer tasks of 1 higher priority after waiting for this period
+
+DEFAULT_TIME_SLICE = 0.01 # seconds, maximum duration of a slice of TimeSlicedTask
+
+ADAPTIVE_SIZING_INTERVAL = 0.1 # seconds between sizing decisions of adaptive Executor
+
+ADAPTIVE_WAIT_THRESHOLD = 0.001 # seconds, smoothed queue wait which is regarded as shortage of threads
+
+ADAPTIVE_WAIT_SMOOTHING = 0.2 # weight of the newest sample in the smoothed queue wait
+
+ADAPTIVE_SHRINK_DELAY = 30 # seconds without shortage of threads before adaptive Executor shrinks the core size
+
+RejectionPolicy = enumOf(int,
+                         BLOCK = 0, # blocks the submitter until the queue has space(or raises RejectedExecutionError after rejectionTimeout)
+                         CALLER_RUNS = 1, # performs the task in the submitter thread
+                         DISCARD_OLDEST = 2, # rejects the oldest queued task, and enqueues the task
+                         RAISE = 3) # raises RejectedExecutionError
+
 class ExecutorThreadInterrupt(Exception):
     pass
 
 class TaskError(Exception):
     pass
 
+class RejectedExecutionError(TaskError):
+    """
+    Raised if a task is rejected by the bounded submission queue of Executor
+    """
+    pass
+
+class DeadlineExceededError(TaskError):
+    """
+    Raised if a task is taken by a thread after its deadline, instead of performing the task late
+    """
+    pass
+
+class TaskCancelledError(TaskError):
+    """
+    Raised if a task is cancelled before it is done
+    """
+    pass
+
+class TaskGroupError(TaskError):
+    """
+    Raised by TaskGroup if member tasks failed.
+    excInfos is a list of exc_info of the failed members in the order of failure, the first one caused fail-fast cancellation.
+    """
+    def __init__(self, excInfos):
+        first = excInfos[0][1] if not excInfos[0][1] is None else excInfos[0][0]
+        TaskError.__init__(self, "%d task(s) failed, first: %r" % (len(excInfos), first))
+        self.excInfos = excInfos
+    
+    @property
+    def exceptions(self):
+        """
+        A list of exceptions of the failed members
+        """
+        return [excInfo[1] for excInfo in self.excInfos]
+
 class FutureError(Exception):
     pass
 
 class CancellationTokenSource(object):
     """
     (Like .net framework's class System.Threading.CancellationTokenSource) This class represents a 'Cancellation' for task.
+    isCancelled is a plain attribute(read-only by convention, use cancel()), so checking cancellation costs an attribute load.
     """
     class CancellationToken(object):
         """
         A token object which used to check cancelled or not.
+        isCancelled is a plain attribute which is set by the corresponding CancellationTokenSource.
         """
         def __init__(self, parent):
             """
@@ -45,48 +114,188 @@ class CancellationTokenSource(object):
             @param parent: A corresponding CancellationTokenSource object
             """
             self.__parent = parent
+            self.isCancelled = False
         
-        @property
-        def isCancelled(self):
+        def register(self, callback):
+            """
+            @see: CancellationTokenSource.register
+            """
+            return self.__parent.register(callback)
+        
+        def unregister(self, callback):
+            """
+            @see: CancellationTokenSource.unregister
+            """
+            return self.__parent.unregister(callback)
+        
+        def raiseIfCancelled(self):
             """
-            Returns the corresponding CancellationTokenSource object's isCancelled property.
-            This method may be blocking.
+            Raises TaskCancelledError if cancelled
             """
-            return self.__parent.isCancelled()
+            if self.isCancelled:
+                raise TaskCancelledError("Cancellation is requested")
     
-    def __init__(self):
+    def __init__(self, timeout = None):
         """
         Initialize
+        
+        @param timeout: seconds until this source is cancelled automatically, or None
         """
-        self.__condition = threading.RLock()
-        self.__cancelled = False
+        self.__lock = threading.RLock()
+        self.isCancelled = False
+        self.__token = self.CancellationToken(self)
+        self.__callbacks = None
+        self.__links = None # pairs of (parent source, callback registered to the parent)
+        self.__timer = None
+        if not timeout is None:
+            self.cancelAfter(timeout)
     
-    def newToken(self):
+    @classmethod
+    def linked(cls, *sources):
+        """
+        Creates a new CancellationTokenSource which is cancelled when any of the sources is cancelled(or by itself).
+        
+        @param sources: CancellationTokenSource objects
+        @return: new CancellationTokenSource object
         """
-        Takes new CancellationToken object
+        child = cls()
+        for source in sources:
+            if not isinstance(source, CancellationTokenSource):
+                raise ValueError("%s is not CancellationTokenSource" % source)
+            child.__link(source)
+        return child
+    
+    def newChild(self, timeout = None):
+        """
+        Creates a new CancellationTokenSource which is cancelled when this source is cancelled.
+        Cancellation of the child does not affect this source.
         
-        @return: new CancellationToken object which is associated to this
+        @param timeout: seconds until the child is cancelled automatically, or None
+        @return: new CancellationTokenSource object
+        """
+        child = self.linked(self)
+        if not timeout is None:
+            child.cancelAfter(timeout)
+        return child
+    
+    def __link(self, parent):
+        """
+        (internal private) Cancels this source when the parent is cancelled
         """
-        return self.CancellationToken(self.__condition)
+        callback = lambda _: self.cancel()
+        with self.__lock:
+            if self.__links is None:
+                self.__links = []
+            self.__links.append((parent, callback))
+        parent.register(callback)
     
     @property
-    def isCancelled(self):
+    def token(self):
         """
-        Returns True if and only if this CancellationTokenSource had been 'Cancelled'.
+        CancellationToken object which is associated to this
+        """
+        return self.__token
+    
+    def newToken(self):
+        """
+        Takes CancellationToken object(all tokens of a source are the same object)
         
-        @return: True if had been cancelled
+        @return: CancellationToken object which is associated to this
         """
-        with self.__condition:
-            return self.__cancelled
-            
+        return self.__token
+    
+    def register(self, callback):
+        """
+        Registers a callback which is invoked with this source when cancelled.
+        The callback is invoked immediately in the caller thread if already cancelled, or in the thread which cancels this source.
+        Exceptions which are raised by the callback are ignored.
+        
+        @param callback: 1-ary function(forms like (lambda source: ..))
+        @return: the callback
+        """
+        if not callable(callback):
+            raise ValueError("%s is not callable" % callback)
+        with self.__lock:
+            if not self.isCancelled:
+                if self.__callbacks is None:
+                    self.__callbacks = [callback]
+                else:
+                    self.__callbacks.append(callback)
+                return callback
+        _invokeCallback(callback, self)
+        return callback
+    
+    def unregister(self, callback):
+        """
+        Unregisters a callback
+        
+        @return: True if the callback is unregistered, False if not registered(or already invoked)
+        """
+        with self.__lock:
+            if self.__callbacks is None or not callback in self.__callbacks:
+                return False
+            self.__callbacks.remove(callback)
+            return True
+    
+    def cancelAfter(self, timeout):
+        """
+        Cancels this source after timeout seconds. The previous timeout is replaced.
+        
+        @param timeout: seconds until cancellation
+        """
+        with self.__lock:
+            if self.isCancelled:
+                return
+            if not self.__timer is None:
+                self.__timer.cancel()
+            self.__timer = _cancellationTimerWheel().schedule(timeout, lambda _: self.cancel())
+    
     def cancel(self):
         """
-        Mark this CancellationTokenSource object to 'Cancelled'.
-        This method may be blocking.
+        Mark this CancellationTokenSource object to 'Cancelled', and invokes registered callbacks.
         This method is executed atomically.
+        
+        @return: True if cancelled by this invocation, False if already cancelled
         """
-        with self.__condition:
-            self.__cancelled = True
+        with self.__lock:
+            if self.isCancelled:
+                return False
+            self.__token.isCancelled = True
+            self.isCancelled = True
+            callbacks, self.__callbacks = self.__callbacks, None
+        self.dispose()
+        if callbacks:
+            for callback in callbacks:
+                _invokeCallback(callback, self)
+        return True
+    
+    def dispose(self):
+        """
+        Releases the timeout and links to parent sources. This source is never cancelled by them after that.
+        """
+        with self.__lock:
+            timer, self.__timer = self.__timer, None
+            links, self.__links = self.__links, None
+        if not timer is None:
+            timer.cancel()
+        if links:
+            for parent, callback in links:
+                parent.unregister(callback)
+
+_timerWheel = None
+
+_timerWheelLock = threading.Lock()
+
+def _cancellationTimerWheel():
+    """
+    (internal) Returns the TimerWheel which cancels CancellationTokenSource objects on timeout
+    """
+    global _timerWheel
+    with _timerWheelLock:
+        if _timerWheel is None:
+            from pyth2.concurrent.Timer import TimerWheel # Timer depends on this module
+            _timerWheel = TimerWheel()
+        return _timerWheel
 
 class Executor(object):
     """
@@ -111,6 +320,13 @@ class Executor(object):
             """
             self.__taskQueue.put(task, True)
         
+        @property
+        def executor(self):
+            """
+            Executor which owns this thread
+            """
+            return self.__parent
+        
         def terminate(self): # no way to forcibly abort..?
             """
             Sets termination flag to True
@@ -122,16 +338,22 @@ class Executor(object):
                 sys.settrace(lambda frame, event, arg: None)
             while not self.__exitLoop:
                 try:
-                    currentTask = self.__taskQueue.get(True, timeout = WORKER_THREAD_LIFETIME)
+                    currentTask = self.__taskQueue.get(True, timeout = self.__parent._idleTimeout(self))
+                    if currentTask is None:
+                        continue # woken up to re-evaluate the idle timeout
                     self.currentTask = None
 #                     print "(EXECUTE %s, %s)" % (currentTask.args, id(self))
-                    currentTask()
+                    resultPair = currentTask()
+                    if self.__parent.metrics:
+                        self.__parent.metrics.taskPerformed(self.__parent, currentTask, resultPair)
                 except ExecutorThreadInterrupt:
                     # Thread is interrupted
                     break
                 except _UNUSED_QUEUE_EMPTY:
-                    # Cannot obtain next task
-                    break
+                    # Cannot obtain next task, core threads keep waiting
+                    if self.__parent._retireThread(self):
+                        return
+                    continue
                 except:
                     # unhandled exception
                     if callable(self.__parent.unhandledExceptionHandler):
@@ -159,10 +381,90 @@ class Executor(object):
                     targetFrame.f_trace = raiseInterruptor
                 targetFrame = targetFrame.f_back
             del targetFrame
-                        
-                
     
-    def __init__(self, daemonize = True, poolMaxSize = None, unhandledExceptionHandler = None, taskType = None):
+    class StealingThread(WrappedThread):
+        """
+        Threads for Executor in work-stealing mode.
+        Each thread owns a deque. Tasks are pushed directly into the deque by submitters, and idle threads steal tasks from the other threads.
+        """
+        def __init__(self, parent):
+            Executor.WrappedThread.__init__(self, parent)
+            self.__parent = parent
+            self.__deque = collections.deque()
+            self.__exitLoop = False
+        
+        def addTask(self, task):
+            """
+            Pushes a task into the tail of this thread's deque.
+            
+            @param task: a task
+            """
+            self.__deque.append(task)
+        
+        def stealTask(self):
+            """
+            Steals a task from the tail of this thread's deque.
+            This method is called by the other threads, the owner thread takes tasks from the head.
+            
+            @return: a task, or None if the deque is empty
+            """
+            try:
+                return self.__deque.pop()
+            except IndexError:
+                return None
+        
+        def hasTasks(self):
+            """
+            Returns True if this thread's deque is not empty.
+            """
+            return len(self.__deque) > 0
+        
+        @property
+        def queueDepth(self):
+            """
+            Number of tasks in this thread's deque
+            """
+            return len(self.__deque)
+        
+        def isOwnedBy(self, executor):
+            """
+            Returns True if this thread belongs to the executor.
+            """
+            return self.__parent is executor
+        
+        def terminate(self):
+            """
+            Sets termination flag to True
+            """
+            self.__exitLoop = True
+        
+        def run(self):
+            if THREAD_SIGNAL_TRACE_ENABLED:
+                sys.settrace(lambda frame, event, arg: None)
+            parent = self.__parent
+            deque = self.__deque
+            while not self.__exitLoop:
+                try:
+                    currentTask = deque.popleft()
+                except IndexError:
+                    currentTask = parent._stealTask(self)
+                    if currentTask is None:
+                        continue
+                try:
+                    resultPair = currentTask()
+                    if parent.metrics:
+                        parent.metrics.taskPerformed(parent, currentTask, resultPair)
+                except ExecutorThreadInterrupt:
+                    # Task is interrupted, but the thread is kept alive because the work-stealing pool has fixed size
+                    pass
+                except:
+                    # unhandled exception
+                    if callable(parent.unhandledExceptionHandler):
+                        parent.unhandledExceptionHandler(self, currentTask)
+    
+    def __init__(self, daemonize = True, poolMaxSize = None, unhandledExceptionHandler = None, taskType = None, workStealing = False,
+                 queueCapacity = None, rejectionPolicy = RejectionPolicy.BLOCK, rejectionTimeout = None,
+                 prioritized = False, priorityAging = DEFAULT_PRIORITY_AGING, metrics = None, coreSize = None, adaptive = False):
         """
         Initializer
         
@@ -170,25 +472,86 @@ class Executor(object):
         @param poolMaxSize: maximum number of threads are spawn if the argument is natural(more than 1 integral) number, or number of demand threads are spawn if None
         @param unhandledExceptionHandler: a function which is invoked at a unhandled exception has occurred(forms like (lambda worker_thread, task: ..)), or exception are ignored if None
         @param taskType: subtype of Task which is used for creation of new Task
+        @param workStealing: if True, poolMaxSize(or DEFAULT_WORK_STEALING_POOL_SIZE if None) threads are spawn at once and each thread owns a deque of tasks, without central dispatcher thread
+        @param queueCapacity: maximum number of queued tasks, or None for unbounded queue. Work-stealing mode does not support bounded queue.
+        @param rejectionPolicy: one of RejectionPolicy which is applied when the queue is full
+        @param rejectionTimeout: timeout in seconds of RejectionPolicy.BLOCK, or None to block forever
+        @param prioritized: if True, queued tasks are taken in the order of Task.priority(higher first) instead of FIFO. Work-stealing mode and RejectionPolicy.DISCARD_OLDEST do not support priorities.
+        @param priorityAging: seconds of waiting which is equivalent to 1 priority, so low priority tasks are not starved
+        @param metrics: an instrumentation object(e.g. pyth2.concurrent.Metrics.ExecutorMetrics) which receives events of tasks and threads, or None
+        @param coreSize: number of threads which are started at construction and never expire, or None for 0(threads are created on demand and expire after WORKER_THREAD_LIFETIME seconds idle)
+        @param adaptive: if True, the number of threads which never expire is adjusted between coreSize and poolMaxSize by measured queue wait and throughput
         """
         if not poolMaxSize is None and int(poolMaxSize) <= 0:
             raise ValueError("Pool max size must be more than 0")
+        if not queueCapacity is None and int(queueCapacity) <= 0:
+            raise ValueError("Queue capacity must be more than 0")
+        if not queueCapacity is None and workStealing:
+            raise ValueError("Work-stealing mode does not support bounded queue")
+        if prioritized and workStealing:
+            raise ValueError("Work-stealing mode does not support priorities")
+        if prioritized and float(priorityAging) <= 0:
+            raise ValueError("Priority aging must be more than 0")
+        if not isinstance(rejectionPolicy, RejectionPolicy):
+            raise ValueError("%s is not a RejectionPolicy" % rejectionPolicy)
+        if prioritized and rejectionPolicy == RejectionPolicy.DISCARD_OLDEST:
+            raise ValueError("Prioritized queue does not support DISCARD_OLDEST, the head of the queue is the highest priority task")
+        if not coreSize is None and int(coreSize) < 0:
+            raise ValueError("Core size must be 0 or more")
+        if not coreSize is None and not poolMaxSize is None and int(coreSize) > int(poolMaxSize):
+            raise ValueError("Core size must not be more than pool max size")
+        if (coreSize or adaptive) and workStealing:
+            raise ValueError("Work-stealing mode has fixed number of threads")
         
         self.__pool = set()
         self.__poolCondition = threading.Condition()
-        self.__submitted = Queue.Queue()
+        self.__capacity = int(queueCapacity) if not queueCapacity is None else None
+        self.__rejectionPolicy = rejectionPolicy
+        self.__rejectionTimeout = rejectionTimeout
+        self.__submitted = Queue.Queue(self.__capacity or 0) if not prioritized else _PriorityTaskQueue(self.__capacity or 0, float(priorityAging))
 #         self.__namedSubmitted = {}
         self.__daemonize = daemonize
         self.__creationTime = 0
         self.__maxSize = int(poolMaxSize) if not poolMaxSize is None else None
+        self.__stealers = None
+        self.__coreSize = int(coreSize) if not coreSize is None else 0
+        self.__currentCoreSize = self.__coreSize
+        self.__adaptive = adaptive
+        self.__waitAverage = 0.0
+        self.__throughput = 0.0
+        self.__dispatched = 0
+        self.__peakBusy = 0
+        self.__grown = False
+        self.__lastSizing = time.time()
+        self.__lastShortage = 0.0
         
         self.unhandledExceptionHandler = unhandledExceptionHandler
         self.taskType = taskType if isinstance(taskType, Task) else Task
+        self.metrics = metrics
         
-        self.__worker = threading.Thread(target = self.__acception)
-        self.__worker.daemon = True
-        with self.__poolCondition:
-            self.__worker.start()
+        self._startScheduler(workStealing)
+    
+    def _startScheduler(self, workStealing):
+        """
+        (internal) Starts threads which perform submitted tasks.
+        Subtypes which perform tasks elsewhere override this method and _schedule method.
+        
+        @param workStealing: True if work-stealing mode
+        """
+        if workStealing:
+            self.__idleCondition = threading.Condition()
+            self.__idleCount = 0
+            self.__roundRobin = itertools.count()
+            self.__stealers = tuple(self.StealingThread(self) for _ in xrange(self.__maxSize or DEFAULT_WORK_STEALING_POOL_SIZE))
+            for t in self.__stealers:
+                t.daemon = self.__daemonize
+                t.start()
+        else:
+            self.prestartCoreThreads()
+            self.__worker = threading.Thread(target = self.__acception)
+            self.__worker.daemon = True
+            with self.__poolCondition:
+                self.__worker.start()
     
     def _detachThread(self, wrappedThread):
         """
@@ -203,28 +566,233 @@ class Executor(object):
         (internal) Purges thread from thread pool
         """
         with self.__poolCondition:
-            self.__pool.remove(wrappedThread)
+            self.__pool.discard(wrappedThread) # an interrupted thread is not in the pool
             self.__poolCondition.notifyAll()
             self.__creationTime -= 1
+        if self.metrics:
+            self.metrics.threadPurged(self, wrappedThread)
+    
+    def _idleTimeout(self, wrappedThread):
+        """
+        (internal) Returns seconds of waiting for next task of an idle thread, or None to wait forever if the thread is a core thread.
+        Core threads must not wait with timeout, because timed waits of Python 2 poll with sleeps up to 50 msec and delay wake-up.
+        """
+        return None if self.__creationTime <= self.__currentCoreSize else WORKER_THREAD_LIFETIME
+    
+    def _retireThread(self, wrappedThread):
+        """
+        (internal) Decides whether an idle thread expires. Threads up to the current core size never expire.
+        
+        @return: True if the thread is purged from thread pool and should terminate
+        """
+        with self.__poolCondition:
+            if not wrappedThread in self.__pool:
+                return False # taken by the dispatcher just now, a task is arriving
+            if self.__adaptive:
+                self.__resize(time.time()) # measures the last burst before the lull
+                self.__waitAverage = 0.0 # an idle thread means no task is waiting
+            if self.__creationTime <= self.__currentCoreSize:
+                return False
+            self.__pool.remove(wrappedThread)
+            self.__creationTime -= 1
+            self.__poolCondition.notifyAll()
+        if self.metrics:
+            self.metrics.threadPurged(self, wrappedThread)
+        return True
+    
+    def __spawnThread(self):
+        """
+        (internal private) Creates and starts a new thread. The caller must hold the pool condition.
+        """
+        t = self.WrappedThread(self)
+        t.daemon = self.__daemonize
+        t.start()
+        self.__creationTime += 1
+        if self.metrics:
+            self.metrics.threadCreated(self, t)
+        return t
     
     def _takeThread(self):
         """
         (internal) Takes next available thread from thread pool, or creates new thread if no threads in the thread pool and the pool has space
         """
         with self.__poolCondition:
-            if self.__pool:
-                return self.__pool.pop()
-            
-            if self.__maxSize is None or self.__creationTime < self.__maxSize:
-                t = self.WrappedThread(self)
-                t.start()
-                self.__creationTime += 1
-                return t
-            else:
+            begin = None
+            while not self.__pool:
+                if self.__maxSize is None or self.__creationTime < self.__maxSize:
+                    return self.__spawnThread()
                 # wait for free thread
-                while len(self.__pool) == 0:
-                    self.__poolCondition.wait()
-                return self.__pool.pop()
+                if begin is None:
+                    begin = time.time()
+                self.__poolCondition.wait()
+            if not begin is None and self.metrics:
+                self.metrics.takeThreadBlocked(self, time.time() - begin)
+            return self.__pool.pop()
+    
+    def prestartCoreThreads(self):
+        """
+        Starts idle threads up to the current core size, so that first tasks after construction or a lull do not pay thread creation.
+        
+        @return: number of started threads
+        """
+        if not self.__stealers is None:
+            return 0
+        with self.__poolCondition:
+            count = 0
+            while self.__creationTime < self.__currentCoreSize:
+                self.__pool.add(self.__spawnThread())
+                count += 1
+            if count:
+                self.__poolCondition.notifyAll()
+            return count
+    
+    def _stealTask(self, thief):
+        """
+        (internal) Steals a task from the other work-stealing threads, or parks the thief for a while if no tasks are found
+        
+        @param thief: a StealingThread which has empty deque
+        @return: a task, or None if no tasks are found
+        """
+        stealers = self.__stealers
+        size = len(stealers)
+        offset = random.randrange(size)
+        for i in xrange(size):
+            victim = stealers[(offset + i) % size]
+            if not victim is thief:
+                task = victim.stealTask()
+                if not task is None:
+                    return task
+        with self.__idleCondition:
+            self.__idleCount += 1
+            try:
+                # re-check under the condition, submitters notify only if they observe idle threads
+                if not any(t.hasTasks() for t in stealers):
+                    self.__idleCondition.wait(STEALING_IDLE_WAIT)
+            finally:
+                self.__idleCount -= 1
+        return None
+    
+    def _schedule(self, task, rejectionPolicy = None):
+        """
+        (internal) Puts a task into the scheduler
+        
+        @param rejectionPolicy: RejectionPolicy which overrides the policy of this Executor for the task, or None
+        """
+        if self.metrics or self.__adaptive:
+            task.timed = True
+            task.enqueuedAt = time.time()
+        if self.metrics:
+            self.metrics.taskSubmitted(self, task)
+        if self.__stealers is None:
+            if self.__capacity is None:
+                self.__submitted.put(task)
+            else:
+                self.__offer(task, self.__rejectionPolicy if rejectionPolicy is None else rejectionPolicy)
+            return
+        self.__push(task)
+    
+    def _reschedule(self, task):
+        """
+        (internal) Puts a task which has yielded its thread back into the scheduler(e.g. the next slice of TimeSlicedTask).
+        The task is already accepted and counted by metrics, so it is put without metrics, blocking nor the rejection policy even if the bounded queue is full.
+        """
+        if self.__stealers is None:
+            _putAll(self.__submitted, (task,))
+        else:
+            self.__push(task)
+    
+    def __push(self, task):
+        """
+        (internal private) Pushes a task into a deque of work-stealing threads
+        """
+        current = threading.currentThread()
+        if isinstance(current, Executor.StealingThread) and current.isOwnedBy(self):
+            current.addTask(task) # locality: tasks submitted by a worker are pushed into its own deque
+        else:
+            self.__stealers[self.__roundRobin.next() % len(self.__stealers)].addTask(task)
+        if self.__idleCount:
+            with self.__idleCondition:
+                self.__idleCondition.notify()
+    
+    def _scheduleMany(self, tasks):
+        """
+        (internal) Puts tasks into the scheduler at once
+        """
+        if self.metrics or self.__adaptive:
+            now = time.time()
+            for task in tasks:
+                task.timed = True
+                task.enqueuedAt = now
+        if self.metrics:
+            for task in tasks:
+                self.metrics.taskSubmitted(self, task)
+        if self.__stealers is None:
+            if self.__capacity is None:
+                _putAll(self.__submitted, tasks)
+            else:
+                for task in tasks:
+                    self.__offer(task, self.__rejectionPolicy)
+            return
+        size = len(self.__stealers)
+        offset = self.__roundRobin.next()
+        for i, task in enumerate(tasks):
+            self.__stealers[(offset + i) % size].addTask(task)
+        if self.__idleCount:
+            with self.__idleCondition:
+                self.__idleCondition.notify(len(tasks))
+    
+    def __offer(self, task, policy):
+        """
+        (internal private) Puts a task into the bounded queue by the rejection policy
+        
+        @raise RejectedExecutionError: the task is rejected
+        """
+        try:
+            if policy == RejectionPolicy.BLOCK:
+                self.__submitted.put(task, True, self.__rejectionTimeout)
+                return
+            self.__submitted.put_nowait(task)
+            return
+        except Queue.Full:
+            if policy == RejectionPolicy.BLOCK or policy == RejectionPolicy.RAISE:
+                if self.metrics:
+                    self.metrics.taskRejected(self, task)
+                raise RejectedExecutionError("Queue is full: capacity=%d" % self.__capacity)
+        if policy == RejectionPolicy.CALLER_RUNS:
+            resultPair = task()
+            if self.metrics:
+                self.metrics.taskPerformed(self, task, resultPair)
+            return
+        # RejectionPolicy.DISCARD_OLDEST
+        while True:
+            try:
+                self.__submitted.put_nowait(task)
+                return
+            except Queue.Full:
+                try:
+                    oldest = self.__submitted.get_nowait()
+                    self.__submitted.task_done()
+                    oldest._complete((None, (RejectedExecutionError, RejectedExecutionError("Discarded by a newer task"), None)))
+                    if self.metrics:
+                        self.metrics.taskRejected(self, oldest)
+                except Queue.Empty:
+                    pass
+    
+    @property
+    def queueDepth(self):
+        """
+        (gauge) Number of tasks which are queued but not yet taken by threads
+        """
+        if self.__stealers is None:
+            return self.__submitted.qsize()
+        return sum(t.queueDepth for t in self.__stealers)
+    
+    @property
+    def queueCapacity(self):
+        """
+        Maximum number of queued tasks, or None for unbounded
+        """
+        return self.__capacity
     
     @property
     def daemonize(self):
@@ -233,6 +801,64 @@ class Executor(object):
         """
         return self.__daemonize
     
+    @property
+    def coreSize(self):
+        """
+        Number of threads which never expire, given at construction
+        """
+        return self.__coreSize
+    
+    @property
+    def poolMaxSize(self):
+        """
+        Maximum number of threads, or None for unbounded
+        """
+        return self.__maxSize
+    
+    @property
+    def currentCoreSize(self):
+        """
+        (gauge) Number of threads which never expire at present, differs from coreSize if adaptive
+        """
+        return self.__currentCoreSize
+    
+    @property
+    def threadCount(self):
+        """
+        (gauge) Number of live threads in thread pool(both idle and busy)
+        """
+        if not self.__stealers is None:
+            return len(self.__stealers)
+        return self.__creationTime
+    
+    @property
+    def adaptive(self):
+        """
+        True if the core size is adjusted by measured queue wait and throughput
+        """
+        return self.__adaptive
+    
+    @property
+    def smoothedQueueWait(self):
+        """
+        (gauge) Exponentially smoothed seconds from enqueue to dispatch into a thread, measured if adaptive
+        """
+        return self.__waitAverage
+    
+    @property
+    def throughput(self):
+        """
+        (gauge) Dispatched tasks per second in the last sizing interval, measured if adaptive
+        """
+        return self.__throughput
+    
+    @property
+    def workStealing(self):
+        """
+        True if this executor is in work-stealing mode
+        """
+        return not self.__stealers is None
+    
     def submit(self, someCallable, *args, **kwds):
         """
         Submits a new task into the Executor
@@ -243,22 +869,270 @@ class Executor(object):
         @return: new Future object
         """
 #         print "(SUBMITTED %s)" % args
+        task, future = self.__prepare(someCallable, args, kwds)
+        self._schedule(task)
+        return future
+    
+    def _trySubmit(self, someCallable, *args, **kwds):
+        """
+        (internal) Submits a new task without blocking nor performing it in the caller thread regardless of the rejection policy,
+        for callers which must not stall(e.g. the thread of TimerWheel)
+        
+        @return: new Future object
+        @raise RejectedExecutionError: the bounded queue is full
+        """
+        task, future = self.__prepare(someCallable, args, kwds)
+        if self.__capacity is None:
+            self._schedule(task) # an unbounded queue never blocks
+        else:
+            self._schedule(task, RejectionPolicy.RAISE)
+        return future
+    
+    def submitWith(self, someCallable, args = (), kwds = None, priority = None, deadline = None):
+        """
+        Submits a new task into the Executor with scheduling parameters.
+        
+        @param someCallable: callable object to be wrapped into Task object or subtype of self.taskType object
+        @param args: positional arguments for the callable object
+        @param kwds: keyword arguments for the callable object
+        @param priority: Task.priority(higher is taken earlier if this Executor is prioritized), or None to keep the task's priority
+        @param deadline: Task.deadline(in the form of time.time()), or None to keep the task's deadline
+        @return: new Future object
+        """
+        task, future = self.__prepare(someCallable, args, kwds or {})
+        if not priority is None:
+            task.priority = priority
+        if not deadline is None:
+            task.deadline = deadline
+        self._schedule(task)
+        return future
+    
+    def submitMany(self, someCallable, argsIterable, batchSize = DEFAULT_SUBMIT_BATCH_SIZE):
+        """
+        Submits new tasks into the Executor.
+        Tasks are enqueued in batches of batchSize, so each task does not make a round-trip to the scheduler.
+        
+        @param someCallable: callable object to be wrapped into Task object
+        @param argsIterable: an iterable of positional arguments(tuples) for the callable object
+        @param batchSize: number of tasks which are enqueued at once
+        @return: a list of new Future objects in the order of argsIterable
+        """
+        if int(batchSize) <= 0:
+            raise ValueError("Batch size must be more than 0")
+        futures = []
+        for batch in _chunked(iter(argsIterable), int(batchSize)):
+            tasks = []
+            for args in batch:
+                task, future = self.__prepare(someCallable, args, {})
+                tasks.append(task)
+                futures.append(future)
+            self._scheduleMany(tasks)
+        return futures
+    
+    def map(self, function, iterable, chunkSize = 1, ordered = True, lookAhead = DEFAULT_MAP_LOOK_AHEAD):
+        """
+        Applies the function to each element of the iterable in the Executor, like built-in map function.
+        Elements are performed in chunks of chunkSize(a chunk is a task), and at most lookAhead chunks are in flight.
+        So the iterable is consumed lazily as results are consumed.
+        
+        @param function: 1-ary function
+        @param iterable: an iterable object
+        @param chunkSize: number of elements which are performed in a task
+        @param ordered: results are yielded in the order of the iterable if True, or in the order of completion of chunks if False
+        @param lookAhead: maximum number of chunks in flight
+        @return: a generator of results
+        @raise: exception if a function invocation raises an exception(at the time the result would be yielded)
+        """
+        if not callable(function):
+            raise ValueError("%s is not callable" % function)
+        if int(chunkSize) <= 0:
+            raise ValueError("Chunk size must be more than 0")
+        if int(lookAhead) <= 0:
+            raise ValueError("Look-ahead must be more than 0")
+        chunks = _chunked(iter(iterable), int(chunkSize))
+        if ordered:
+            return self.__orderedMap(function, chunks, int(lookAhead))
+        else:
+            return self.__unorderedMap(function, chunks, int(lookAhead))
+    
+    def __prepare(self, someCallable, args, kwds):
+        """
+        (internal private) Creates a pair of (Task, Future) without scheduling
+        """
         task = self.taskType(someCallable, *args, **kwds) if not isinstance(someCallable, self.taskType) else someCallable
         future = Future(task)
         task._setFuture(future)
-        self.__submitted.put(task)
-        return future
+        return task, future
+    
+    def __submitChunks(self, function, chunks, count):
+        """
+        (internal private) Submits at most count chunks at once
+        
+        @return: a list of Future objects of the chunks
+        """
+        tasks = []
+        futures = []
+        for chunk in itertools.islice(chunks, count):
+            task, future = self.__prepare(_mapChunk, (function, chunk), {})
+            tasks.append(task)
+            futures.append(future)
+        if tasks:
+            self._scheduleMany(tasks)
+        return futures
+    
+    def __orderedMap(self, function, chunks, lookAhead):
+        """
+        (internal private) Generator for ordered Executor.map
+        """
+        pending = collections.deque(self.__submitChunks(function, chunks, lookAhead))
+        while pending:
+            results = pending.popleft().get()
+            if len(pending) <= lookAhead // 2:
+                pending.extend(self.__submitChunks(function, chunks, lookAhead - len(pending)))
+            for result in results:
+                yield result
+    
+    def __unorderedMap(self, function, chunks, lookAhead):
+        """
+        (internal private) Generator for unordered Executor.map
+        """
+        completed = Queue.Queue()
+        pending = set() # holds strong references of Future objects, Task objects refer them by weakref
+        while True:
+            if len(pending) <= lookAhead // 2:
+                futures = self.__submitChunks(function, chunks, lookAhead - len(pending))
+                pending.update(futures)
+                for future in futures:
+                    future._addCompletionListener(completed.put)
+            if not pending:
+                return
+            future = completed.get()
+            pending.remove(future)
+            for result in future.get():
+                yield result
+    
+    def __acception(self):
+        """
+        (internal private) Takes available threads and throw next task into the threads
+        """
+        while True:
+            last = self.__submitted.get()
+            t = self._takeThread()
+            if self.__adaptive:
+                self.__adapt(last)
+#             print "(Accepted %s, thread=%s)" % (last.args, id(t))
+            t.addTask(last)
+            self.__submitted.task_done()
+    
+    def __adapt(self, task):
+        """
+        (internal private) Measures the queue wait of a dispatched task and the number of busy threads for adaptive sizing
+        """
+        now = time.time()
+        with self.__poolCondition:
+            if not task.enqueuedAt is None:
+                self.__waitAverage += ADAPTIVE_WAIT_SMOOTHING * ((now - task.enqueuedAt) - self.__waitAverage)
+            self.__dispatched += 1
+            self.__peakBusy = max(self.__peakBusy, self.__creationTime - len(self.__pool))
+            if now - self.__lastSizing >= ADAPTIVE_SIZING_INTERVAL:
+                self.__resize(now)
+    
+    def __resize(self, now):
+        """
+        (internal private) Adjusts the current core size by the measured queue wait and the dispatch throughput. The caller must hold the pool condition.
+        If tasks have waited for threads, the core size grows up to the peak number of busy threads plus a spare thread,
+        but consecutive growth is stopped unless the throughput is improved(more threads do not help GIL-bound tasks).
+        After ADAPTIVE_SHRINK_DELAY seconds without shortage, the core size shrinks to the peak number of busy threads(or coreSize),
+        and idle threads are woken up so that surplus threads expire after WORKER_THREAD_LIFETIME seconds idle.
+        """
+        throughput = self.__dispatched / max(now - self.__lastSizing, ADAPTIVE_SIZING_INTERVAL)
+        grown = False
+        if self.__waitAverage > ADAPTIVE_WAIT_THRESHOLD:
+            self.__lastShortage = now
+            target = self.__peakBusy + 1 if self.__maxSize is None else min(self.__peakBusy + 1, self.__maxSize)
+            if target > self.__currentCoreSize and (not self.__grown or throughput > self.__throughput):
+                self.__currentCoreSize = target
+                self.prestartCoreThreads()
+                grown = True
+        elif self.__currentCoreSize > self.__coreSize and now - self.__lastShortage >= ADAPTIVE_SHRINK_DELAY:
+            self.__currentCoreSize = max(self.__coreSize, self.__peakBusy)
+            for t in self.__pool:
+                t.addTask(None)
+        self.__grown = grown
+        self.__throughput = throughput
+        self.__dispatched = 0
+        self.__peakBusy = 0
+        self.__lastSizing = now
+
+def _putAll(queue, items):
+    """
+    (internal) Puts items into Queue.Queue at once, with single lock acquisition
+    """
+    with queue.mutex:
+        for item in items:
+            queue._put(item)
+        queue.unfinished_tasks += len(items)
+        queue.not_empty.notify(len(items))
+
+class _PriorityTaskQueue(Queue.Queue):
+    """
+    (internal) Heap-based queue of tasks ordered by Task.priority, with aging.
+    A task of priority p which is enqueued at time t is ordered by (t - p * aging), so waiting for "aging" seconds is equivalent to 1 higher priority.
+    This keeps the order static(heap-friendly) while low priority tasks cannot be starved.
+    """
+    
+    def __init__(self, maxsize, aging):
+        self.aging = aging
+        self.__sequence = itertools.count()
+        Queue.Queue.__init__(self, maxsize)
+    
+    def _init(self, maxsize):
+        self.queue = []
+    
+    def _qsize(self, len = len):
+        return len(self.queue)
     
-    def __acception(self):
-        """
-        (internal private) Takes available threads and throw next task into the threads
-        """
-        while True:
-            last = self.__submitted.get()
-            t = self._takeThread()
-#             print "(Accepted %s, thread=%s)" % (last.args, id(t))
-            t.addTask(last)
-            self.__submitted.task_done()
+    def _put(self, task):
+        heapq.heappush(self.queue, (time.time() - task.priority * self.aging, self.__sequence.next(), task))
+    
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
+
+def _chunked(iterator, chunkSize):
+    """
+    (internal) Generates lists of at most chunkSize elements from the iterator
+    """
+    while True:
+        chunk = list(itertools.islice(iterator, chunkSize))
+        if not chunk:
+            return
+        yield chunk
+
+def _mapChunk(function, chunk):
+    """
+    (internal) Task body of a chunk of Executor.map
+    """
+    return [function(elm) for elm in chunk]
+
+def _awaitCondition(condition, isReady, timeout):
+    """
+    (internal) Waits on the condition until isReady() returns True or the timeout passes. The caller must hold the condition.
+    
+    @param isReady: 0-ary function
+    @param timeout: seconds, or None to wait forever
+    @return: the last value of isReady()
+    """
+    if timeout is None:
+        while not isReady():
+            condition.wait()
+        return True
+    deadline = time.time() + timeout
+    while not isReady():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        condition.wait(remaining)
+    return True
 
 class Task(object):
     """
@@ -270,7 +1144,12 @@ class Task(object):
     "get" returns if and only if 2nd value of the return value of "getSafe" is NOT None, or raises exception(2nd value) if the 2nd value IS None.
     
     All methods are thread-safety.
+    Task objects are compact(__slots__), the condition for waiting is allocated only when a thread waits for the task. Subtypes may have __dict__.
     """
+    
+    __slots__ = ("function", "args", "kwds", "priority", "deadline", "timed", "enqueuedAt", "startedAt", "finishedAt",
+                 "__resultPair", "__future", "__then", "__runner", "__cancelRequested", "__lock", "__condition", "__weakref__")
+    
     def __init__(self, taskBody, *args, **kwds):
         """
         Initializer
@@ -286,34 +1165,85 @@ class Task(object):
         self.function = taskBody
         self.args = args
         self.kwds = kwds
-        self.__resultPair = None
+        self.priority = 0 # scheduling priority for prioritized Executor, higher is taken earlier
+        self.deadline = None # a deadline in the form of time.time(), the task fails with DeadlineExceededError instead of being performed after the deadline
+        self.timed = False # True to record the timestamps below, set by Executor which has metrics(or adaptive sizing)
+        self.enqueuedAt = None # time.time() when the task is put into an Executor
+        self.startedAt = None # time.time() when the task body is started
+        self.finishedAt = None # time.time() when the task is done
+        self.__resultPair = None # never changes once decided, so it is read without the lock
         self.__future = None
         self.__then = None
-        self.__completeCondition = threading.Condition()
+        self.__runner = None
+        self.__cancelRequested = False
+        self.__lock = threading.Lock()
+        self.__condition = None # allocated by the first waiter
     
     def isDone(self):
         """
         Returns True if the task is completed.
         """
-        with self.__completeCondition:
-            return not self.__resultPair is None
+        return not self.__resultPair is None
     
     def await(self, timeout = None):
         """
         Awaits by threads.Condition.wait method while the task is incomplete.
         
-        @param timeout: a timeout value in seconds.
+        @param timeout: a timeout value in seconds, or None to wait forever
+        @return: True if the task is completed, False if the timeout has passed
         @see threads.Condition.wait
         """
-        with self.__completeCondition:
-            while self.__resultPair is None:
-                self.__completeCondition.wait(timeout)
+        if not self.__resultPair is None:
+            return True
+        with self.__lock:
+            return _awaitCondition(self.__waitCondition(), lambda: not self.__resultPair is None, timeout)
+    
+    def __waitCondition(self):
+        """
+        (internal private) Returns the condition for waiting for completion, allocates it at first time. The caller must hold the lock.
+        """
+        if self.__condition is None:
+            self.__condition = threading.Condition(self.__lock)
+        return self.__condition
+    
+    def cancel(self, cancellationType = None):
+        """
+        Cancels this task.
+        A task which is not yet started is decided with TaskCancelledError immediately, and it is dropped without being performed when a thread takes it.
+        A running task stops before its next then-clause. The running task body itself is interrupted only if THREAD_SIGNAL_TRACE_ENABLED.
+        
+        @param cancellationType: an ExecutorThreadInterrupt instance which interrupts the running task body, or None for default
+        @return: True if the task is cancelled or cancellation is requested to the running task, False if the task is already done
+        """
+        with self.__lock:
+            if not self.__resultPair is None:
+                return False
+            self.__cancelRequested = True
+            runner = self.__runner
+            if runner is None:
+                self.__decide((None, (TaskCancelledError, TaskCancelledError("Task is cancelled before start"), None)))
+        if runner is None:
+            self.__notifyFuture()
+            return True
+        self._cancelRunning(runner, cancellationType)
+        return True
+    
+    def _cancelRunning(self, runner, cancellationType):
+        """
+        (internal) Requests cancellation to the running task body. Subtypes which observe cancellation by themselves override this method.
+        
+        @param runner: the thread which performs the task body
+        @param cancellationType: an ExecutorThreadInterrupt instance, or None for default
+        """
+        if THREAD_SIGNAL_TRACE_ENABLED and hasattr(runner, "_interrupt"):
+            runner._interrupt(cancellationType if not cancellationType is None else ExecutorThreadInterrupt())
     
-    def cancel(self, cancellationType = ExecutorThreadInterrupt()):
-        t = threading.currentThread()
-        if not hasattr(t, "_interrupt"):
-            raise ValueError("Cannot interrupt")
-        t._interrupt(cancellationType)
+    @property
+    def cancelRequested(self):
+        """
+        True if this task is cancelled or cancellation is requested
+        """
+        return self.__cancelRequested
     
     def getSafe(self):
         """
@@ -321,11 +1251,11 @@ class Task(object):
         
         @return: a pair of (task result, exc_info)
         """
-        with self.__completeCondition:
-            if self.__resultPair is None:
-                #raise TaskError("%s is not done" % self)
-                return self.__call__()
-            return self.__resultPair
+        resultPair = self.__resultPair
+        if resultPair is None:
+            #raise TaskError("%s is not done" % self)
+            return self.__call__()
+        return resultPair
     
     def get(self):
         """
@@ -351,9 +1281,11 @@ class Task(object):
         @param kwds: keyword arguments of thenBody
         @return: this Task object
         """
-        with self.__completeCondition:
+        with self.__lock:
             if self.__resultPair:
                 raise TaskError("Task is already done")
+            if not self.__runner is None:
+                raise TaskError("Task is already started")
             
             thenParam = (thenBody, args, kwds)
             if self.__then is None:
@@ -363,11 +1295,111 @@ class Task(object):
             
             return self
     
-    def _setFuture(self, strongRefFuture):
+    def _setFuture(self, strongRefFuture, retains = False):
         """
         (internal) sets associated Future object by weakref
+        
+        @param retains: holds the Future object by strong reference if True(e.g. continuations which may be referred by nothing but this task)
+        """
+        self.__future = weakref.ref(strongRefFuture) if not retains else lambda: strongRefFuture
+    
+    def _thenClauses(self):
+        """
+        (internal) Returns then-clauses in the form of a tuple of (thenBody, args, kwds)
+        """
+        with self.__lock:
+            return tuple(self.__then) if not self.__then is None else ()
+    
+    def _expired(self):
+        """
+        (internal) Returns True if the deadline of this task has passed
+        """
+        return not self.deadline is None and time.time() > self.deadline
+    
+    def _complete(self, resultPair):
+        """
+        (internal) Decides results of this task without performing the task body.
+        This method is used by executors which perform the task body elsewhere(e.g. in another process).
+        
+        @param resultPair: a pair of (task result, exc_info)
+        @return: True if the results are decided by this invocation, or False if the task is already done
+        """
+        with self.__lock:
+            if not self.__resultPair is None:
+                return False
+            self.__decide(resultPair)
+        self.__notifyFuture()
+        return True
+    
+    def __decide(self, resultPair):
+        """
+        (internal private) Decides results and wakes up waiters. The caller must hold the lock, and must invoke __notifyFuture after releasing the lock.
+        """
+        self.__resultPair = resultPair
+        if not self.__condition is None:
+            self.__condition.notifyAll()
+    
+    def __notifyFuture(self):
+        """
+        (internal private) Notifies completion to associated Future object.
+        This method is invoked without the lock, so that completion listeners can use this task(e.g. cancel it).
+        """
+        maybeRef = self.__future() if not self.__future is None else None
+        if maybeRef:
+            maybeRef._markCompleted()
+    
+    def _begin(self):
+        """
+        (internal) Makes the caller thread the runner of this task before performing the task body(or a part of it).
+        Waits for the results if another thread is performing the task, and decides DeadlineExceededError instead of starting after the deadline.
+        
+        @return: the results in the form of a pair of (task result, exc_info) if the task must not be performed, or None if the caller thread performs the task
+        """
+        with self.__lock:
+            if self.__resultPair is None and not self.__runner is None:
+                # performed by another thread
+                _awaitCondition(self.__waitCondition(), lambda: not self.__resultPair is None, None)
+            if not self.__resultPair is None:
+                return self.__resultPair
+            if not self._expired():
+                self.__runner = threading.currentThread()
+                if self.timed and self.startedAt is None:
+                    self.startedAt = time.time()
+                return None
+            resultPair = (None, (DeadlineExceededError, DeadlineExceededError("Deadline exceeded by %f seconds" % (time.time() - self.deadline)), None))
+            self.__decide(resultPair)
+        self.__notifyFuture()
+        return resultPair
+    
+    def _suspend(self):
         """
-        self.__future = weakref.ref(strongRefFuture)
+        (internal) Releases the runner after a part of the task body(e.g. a slice of TimeSlicedTask), so that another thread can perform the rest by _begin.
+        Cancellation which is requested while running is decided here, because the task is not running until the next _begin.
+        """
+        with self.__lock:
+            self.__runner = None
+            cancelled = self.__cancelRequested and self.__resultPair is None
+            if cancelled:
+                self.__decide((None, (TaskCancelledError, TaskCancelledError("Task is cancelled"), None)))
+        if cancelled:
+            self.__notifyFuture()
+    
+    def _finish(self, resultPair):
+        """
+        (internal) Decides results of the task body which is performed by the runner
+        
+        @param resultPair: a pair of (task result, exc_info)
+        @return: the decided results in the form of a pair of (task result, exc_info)
+        """
+        with self.__lock:
+            if self.timed:
+                self.finishedAt = time.time()
+            decided = self.__resultPair is None
+            if decided:
+                self.__decide(resultPair)
+        if decided:
+            self.__notifyFuture()
+        return self.__resultPair
     
     def __call__(self):
         """
@@ -376,37 +1408,42 @@ class Task(object):
         
         @return: a pair of (task result, exc_info)
         """
-        with self.__completeCondition:
-            if not self.__resultPair is None:
-                return self.__resultPair
-            
-            try:
-                partialResult = self.function(*self.args, **self.kwds)
-                if not self.__then is None:
-                    for thenParam in self.__then:
-                        partialResult = thenParam[0](partialResult, *thenParam[1], **thenParam[2])
-                self.__resultPair = (partialResult, None)
-            except:
-                excInfo = sys.exc_info()
-                if ERASE_UNHANDLED_TASK_EXCEPTION_FRAME_LOCALS:
-                    currentExcInfo = excInfo.tb_next # top frame is here, 2nd frame is function body
-                    while currentExcInfo:
-                        frame = currentExcInfo.tb_frame
-                        frame.f_locals.clear()
-                        currentExcInfo = currentExcInfo.tb_next
-                self.__resultPair = (None, excInfo)
-                sys.exc_clear()
-            
-            self.__completeCondition.notifyAll()
-            maybeRef = self.__future() if not self.__future is None else None
-            if maybeRef:
-                maybeRef._markCompleted()
-            return self.__resultPair
+        resultPair = self.__resultPair
+        if not resultPair is None:
+            return resultPair
+        resultPair = self._begin()
+        if not resultPair is None:
+            return resultPair
+        thenClauses = self.__then # never changes once started
+        
+        # the task body is performed without the completion lock, so that the task can be cancelled while running
+        try:
+            partialResult = self.function(*self.args, **self.kwds)
+            if not thenClauses is None:
+                for thenParam in thenClauses:
+                    if self.__cancelRequested:
+                        raise TaskCancelledError("Task is cancelled")
+                    partialResult = thenParam[0](partialResult, *thenParam[1], **thenParam[2])
+            resultPair = (partialResult, None)
+        except:
+            excInfo = sys.exc_info()
+            if ERASE_UNHANDLED_TASK_EXCEPTION_FRAME_LOCALS:
+                currentExcInfo = excInfo.tb_next # top frame is here, 2nd frame is function body
+                while currentExcInfo:
+                    frame = currentExcInfo.tb_frame
+                    frame.f_locals.clear()
+                    currentExcInfo = currentExcInfo.tb_next
+            resultPair = (None, excInfo)
+            sys.exc_clear()
+        return self._finish(resultPair)
 
 class CancellableTask(Task):
     """
     This Task class is an basic concept which can be cancelled by CancellationTokenSource.
     """
+    
+    __slots__ = ("cancellationTokenSource",)
+    
     def __init__(self, func, cancellationTokenSource = None, *args, **kwds):
         """
         Initialize
@@ -417,17 +1454,27 @@ class CancellableTask(Task):
         super(CancellableTask, self).__init__(func, *args, **kwds)
         self.cancellationTokenSource = cancellationTokenSource if isinstance(cancellationTokenSource, CancellationTokenSource) else CancellationTokenSource()
     
-    def cancel(self):
+    def cancel(self, cancellationType = None):
         """
-        Cancel task by corresponding CancellationTokenSource
+        Cancel task by corresponding CancellationTokenSource.
+        The task is dropped if not yet started, or the running task body observes the CancellationTokenSource.
+        
+        @param cancellationType: ignored, running CancellableTask is never interrupted
+        @return: True if the task is cancelled or cancellation is requested to the running task, False if the task is already done
         """
         self.cancellationTokenSource.cancel()
+        return super(CancellableTask, self).cancel(cancellationType)
+    
+    def _cancelRunning(self, runner, cancellationType):
+        pass # cooperative, the task body observes the CancellationTokenSource
 
 class StepwiseTask(CancellableTask):
     """
     Task which executes continuously a generator while the generator returns True-like value.
     """
     
+    steps = 0 # number of performed steps
+    
     def __init__(self, annotatee, cancellationTokenSource = None, *args, **kwds):
         """
         Initialize
@@ -436,19 +1483,149 @@ class StepwiseTask(CancellableTask):
         @param cancellationTokenSource: a hook for cancellation
         """
         super(StepwiseTask, self).__init__(annotatee, cancellationTokenSource, *args, **kwds)
+        self.timed = True # for stepsPerSecond
         self.then(self.__stepwise__)
     
     def __stepwise__(self, gen):
+        source = self.cancellationTokenSource
+        steps = self.steps
         for elm in gen:
-            if not elm or self.cancellationTokenSource.isCancelled:
+            steps += 1
+            self.steps = steps
+            if not elm or source.isCancelled:
                 return
+    
+    @property
+    def stepsPerSecond(self):
+        """
+        Average progress in steps per second since the task is started, or None if not yet started
+        """
+        if self.startedAt is None:
+            return None
+        elapsed = (self.finishedAt if not self.finishedAt is None else time.time()) - self.startedAt
+        return self.steps / elapsed if elapsed > 0 else None
+
+class TimeSlicedTask(StepwiseTask):
+    """
+    StepwiseTask which yields the worker thread after each slice(maxSteps steps or maxTime seconds), and re-enqueues itself on the Executor.
+    Long generators on a small pool make progress in round-robin, instead of monopolizing workers until they finish.
+    Each slice is started like Task, i.e. the remaining slices are dropped after cancellation or the deadline.
+    The result of the task is None, then-clauses are not performed.
+    """
+    
+    def __init__(self, annotatee, executor = None, maxSteps = None, maxTime = DEFAULT_TIME_SLICE, cancellationTokenSource = None, *args, **kwds):
+        """
+        Initialize
+        
+        @param annotatee: a generator function. The function is executed continuously if the generator returns True-like value.
+        @param executor: Executor to re-enqueue the task, or None for the Executor which performs the slice
+        @param maxSteps: maximum steps of a slice, or None
+        @param maxTime: maximum seconds of a slice, or None
+        @param cancellationTokenSource: a hook for cancellation
+        """
+        if maxSteps is None and maxTime is None:
+            raise ValueError("Either maxSteps or maxTime is required")
+        if not maxSteps is None and int(maxSteps) <= 0:
+            raise ValueError("Max steps must be more than 0: %d" % maxSteps)
+        if not maxTime is None and maxTime <= 0:
+            raise ValueError("Max time must be more than 0: %f" % maxTime)
+        super(TimeSlicedTask, self).__init__(annotatee, cancellationTokenSource, *args, **kwds)
+        self.executor = executor
+        self.maxSteps = int(maxSteps) if not maxSteps is None else None
+        self.maxTime = maxTime
+        self.slices = 0 # number of performed slices
+        self.__gen = None
+        self.__scheduled = False # True once submitted to(or re-enqueued on) an Executor
+    
+    def _setFuture(self, strongRefFuture, retains = False):
+        super(TimeSlicedTask, self)._setFuture(strongRefFuture, retains)
+        self.__scheduled = True
+    
+    def getSafe(self):
+        """
+        Waits for completion of all slices, and returns task results in the form of a pair of (task result, exc_info)
+        
+        @return: a pair of (task result, exc_info)
+        @raise TaskError: the task is neither done nor submitted to an Executor, so nothing would complete it
+        """
+        if not self.isDone() and not self.__scheduled:
+            raise TaskError("%s is not submitted to an Executor" % self)
+        self.await()
+        return super(TimeSlicedTask, self).getSafe()
+    
+    def __call__(self):
+        """
+        Performs a slice, and re-enqueues this task if the generator is not finished.
+        The remaining slices are performed in the caller thread if no Executor is available.
+        
+        @return: a pair of (task result, exc_info) if done, or None if re-enqueued
+        """
+        while True:
+            resultPair = self._begin()
+            if not resultPair is None:
+                self.__close()
+                return resultPair
+            try:
+                if self.__gen is None:
+                    self.__gen = self.function(*self.args, **self.kwds)
+                finished = self.__slice()
+            except:
+                resultPair = self._finish((None, sys.exc_info()))
+                sys.exc_clear()
+                return resultPair
+            if finished:
+                return self._finish((None, None))
+            self._suspend()
+            executor = self.executor if not self.executor is None else getattr(threading.currentThread(), "executor", None)
+            if isinstance(executor, Executor):
+                self.__scheduled = True
+                executor._reschedule(self)
+                return None
+    
+    def __close(self):
+        """
+        (internal private) Closes the generator of the task which is decided without finishing(e.g. cancelled while waiting for the next slice)
+        """
+        gen, self.__gen = self.__gen, None
+        if not gen is None:
+            gen.close()
+    
+    def __slice(self):
+        """
+        (internal private) Steps the generator up to maxSteps steps or maxTime seconds
+        
+        @return: True if the generator is finished(or cancelled)
+        """
+        source = self.cancellationTokenSource
+        steps = self.steps
+        stepLimit = steps + self.maxSteps if not self.maxSteps is None else None
+        timeLimit = time.time() + self.maxTime if not self.maxTime is None else None
+        checkInterval = min(self.maxSteps, 64) if not self.maxSteps is None else 64 # limits and progress are checked every checkInterval steps
+        nextCheck = steps + checkInterval
+        self.slices += 1
+        try:
+            for elm in self.__gen:
+                steps += 1
+                if not elm or source.isCancelled:
+                    return True
+                if steps >= nextCheck:
+                    self.steps = steps
+                    if steps == stepLimit or not timeLimit is None and time.time() >= timeLimit:
+                        return False
+                    nextCheck = steps + checkInterval if stepLimit is None else min(steps + checkInterval, stepLimit)
+            return True
+        finally:
+            self.steps = steps
 
 class Future(object):
     """
     Represents Future pattern.
     Future is a results of corresponding task in this context.
+    Like Task, the condition for waiting is allocated only when a thread waits for this future object.
     """
     
+    __slots__ = ("__task", "__completed", "__lock", "__condition", "__completionListeners", "__dependents", "__weakref__")
+    
     def __init__(self, task):
         """
         Initializer
@@ -456,16 +1633,61 @@ class Future(object):
         @param task: Task object which to be performed in the future
         """
         self.__task = task
-        self.__completed = False
-        self.__completedCondition = threading.Condition()
+        self.__completed = False # never changes once True, so it is read without the lock
+        self.__lock = threading.Lock()
+        self.__condition = None # allocated by the first waiter
+        self.__completionListeners = None
+        self.__dependents = None
+    
+    def __waitCondition(self):
+        """
+        (internal private) Returns the condition for waiting for completion, allocates it at first time. The caller must hold the lock.
+        """
+        if self.__condition is None:
+            self.__condition = threading.Condition(self.__lock)
+        return self.__condition
     
     def _markCompleted(self):
         """
         (internal) Marks this future object is decided
         """
-        with self.__completedCondition:
+        with self.__lock:
             self.__completed = True
-            self.__completedCondition.notifyAll()
+            if not self.__condition is None:
+                self.__condition.notifyAll()
+            listeners, self.__completionListeners = self.__completionListeners, None
+        if listeners:
+            for listener in listeners:
+                _invokeCallback(listener, self) # a failing listener must not prevent the others
+    
+    def _addCompletionListener(self, listener):
+        """
+        (internal) Adds a function which is invoked with this future object when this future object is decided.
+        The function is invoked immediately in the caller thread if already decided, or in the thread which decides this future object.
+        
+        @param listener: 1-ary function(forms like (lambda future: ..))
+        """
+        with self.__lock:
+            if not self.__completed:
+                if self.__completionListeners is None:
+                    self.__completionListeners = [listener]
+                else:
+                    self.__completionListeners.append(listener)
+                return
+        listener(self)
+    
+    def _removeCompletionListener(self, listener):
+        """
+        (internal) Removes a function which is added by _addCompletionListener, does nothing if it is already invoked
+        
+        @param listener: the function which is added
+        """
+        with self.__lock:
+            if self.__completionListeners:
+                try:
+                    self.__completionListeners.remove(listener)
+                except ValueError:
+                    pass
     
     @property
     def task(self):
@@ -474,49 +1696,146 @@ class Future(object):
         """
         return self.__task
     
+    @property
+    def timings(self):
+        """
+        Timestamps of the associated Task object in the form of (enqueuedAt, startedAt, finishedAt), elements are None if not yet reached or not recorded(i.e. the Executor has no metrics)
+        """
+        return (self.__task.enqueuedAt, self.__task.startedAt, self.__task.finishedAt)
+    
     @property
     def completed(self):
         """
         Whether this future object is decided
         """
-        with self.__completedCondition:
-            return self.__completed
+        return self.__completed
+    
+    def addDoneCallback(self, callback, executor = None):
+        """
+        Adds a callback which is invoked with this future object when the associated Task object is done.
+        The callback is invoked immediately if already done, so the callback can be added before or after completion.
+        Exceptions which are raised by the callback are ignored.
+        
+        @param callback: 1-ary function(forms like (lambda future: ..))
+        @param executor: an Executor to perform the callback, or None to perform the callback in the thread which completes the task(or the caller thread if already done).
+        The callback is subject to the rejection policy of the Executor, a rejected callback is reported to unhandledExceptionHandler of the Executor.
+        @return: this Future object
+        """
+        if not callable(callback):
+            raise ValueError("%s is not callable" % callback)
+        if executor is None:
+            self._addCompletionListener(lambda future: _invokeCallback(callback, future))
+        else:
+            def _submit(future):
+                task = Task(callback, future)
+                try:
+                    executor.submit(task)
+                except:
+                    task._complete((None, sys.exc_info())) # e.g. RejectedExecutionError
+                    sys.exc_clear()
+                    if callable(executor.unhandledExceptionHandler):
+                        _invokeCallback(executor.unhandledExceptionHandler, threading.currentThread(), task)
+            self._addCompletionListener(_submit)
+        return self
+    
+    def thenAsync(self, thenBody, *args, **kwds):
+        """
+        Appends a continuation which is performed after the associated Task object is done, without blocking any thread.
+        Unlike Task.then, the continuation can be appended after completion and its results are introduced as a new Future object.
+        If the associated Task object is done with an exception, the new Future object is decided by the same exception without performing the continuation.
+        A continuation which is performed by an Executor is subject to its rejection policy, the new Future object is decided by RejectedExecutionError if rejected.
+        
+        @param thenBody: continuation body function(forms like lambda lastResult, *args, **kwds: ..)
+        @param args: positional arguments of thenBody
+        @param kwds: keyword arguments of thenBody, and keyword-only "executor": an Executor to perform the continuation, or None(default) to perform the continuation in the thread which completes the task(or the caller thread if already done)
+        @return: new Future object for the continuation
+        """
+        executor = kwds.pop("executor", None)
+        task = Task(thenBody, None, *args, **kwds)
+        future = Future(task)
+        task._setFuture(future, True) # intermediate continuations of a chain are referred by nothing else
+        with self.__lock:
+            if self.__dependents is None:
+                self.__dependents = [future]
+            else:
+                self.__dependents.append(future)
+        def _continue(source):
+            result, excInfo = source.getSafe()
+            if excInfo:
+                task._complete((None, excInfo))
+                return
+            if task.isDone():
+                return # cancelled
+            task.args = (result,) + args
+            if executor is None:
+                task()
+                return
+            try:
+                executor._schedule(task)
+            except:
+                task._complete((None, sys.exc_info())) # e.g. RejectedExecutionError, which must not be lost in the completion listener
+                sys.exc_clear()
+        self._addCompletionListener(_continue)
+        return future
+    
+    def cancel(self, timeoutForCancel = None, cancellationType = None):
+        """
+        Cancels the associated Task object and continuations which are appended by thenAsync.
+        
+        @param timeoutForCancel: seconds to wait for the completion of the cancelled task, or None not to wait
+        @param cancellationType: an ExecutorThreadInterrupt instance which interrupts the running task body, or None for default
+        @return: True if the task is cancelled or cancellation is requested to the running task, False if the task is already done
+        @see: Task.cancel
+        """
+        cancelled = self.__task.cancel(cancellationType)
+        with self.__lock:
+            dependents = tuple(self.__dependents) if not self.__dependents is None else ()
+        for dependent in dependents:
+            dependent.cancel()
+        if not timeoutForCancel is None and not self.__completed:
+            with self.__lock:
+                _awaitCondition(self.__waitCondition(), lambda: self.__completed, timeoutForCancel)
+        return cancelled
     
-    def cancel(self, timeoutForCancel = None, cancellationType = ExecutorThreadInterrupt()):
-        # TODO
-        self.__task.cancel(cancellationType)
-        if not timeoutForCancel is None:
-            with self.__completedCondition:
-                while not self.__completed:
-                    self.__completedCondition.wait(timeoutForCancel)
+    @property
+    def cancelled(self):
+        """
+        True if the associated Task object is done by cancellation
+        """
+        if not self.completed:
+            return False
+        excInfo = self.__task.getSafe()[1]
+        return not excInfo is None and issubclass(excInfo[0], TaskCancelledError)
     
     def getSafe(self, timeout = None):
         """
         Returns associated Task object's results.
         This method may be blocking while the Task object is performed.
         
-        @param timeout: timeout in seconds
+        @param timeout: timeout in seconds, or None to wait forever
         @return: the results of the associated Task object
+        @raise FutureError: the associated Task object is not done before the timeout
         @see: threading.Condition.wait
         @see: Task.getSafe
         """
-        with self.__completedCondition:
-            while not self.__completed:
-                self.__completedCondition.wait(timeout)
-            
-            return self.__task.getSafe()
+        if not self.__completed:
+            with self.__lock:
+                if not _awaitCondition(self.__waitCondition(), lambda: self.__completed, timeout):
+                    raise FutureError("Future is not completed in %s seconds" % timeout)
+        return self.__task.getSafe()
     
     def get(self, timeout = None):
         """
         Return associated Task object's results, or raises exception if the Task object is done in anomaly.
         This method may be blocking while the Task object is performed.
         
-        @param timeout: timeout in seconds
+        @param timeout: timeout in seconds, or None to wait forever
         @return: the results of the associated Task object
         @raise: exception if the task is done with unhandled exception
+        @raise FutureError: the associated Task object is not done before the timeout
         @see: threading.Condition.wait
         """
-        result, exc_info = self.getSafe(timeout)
+        result, exc_info = self.__task.getSafe() if self.__completed else self.getSafe(timeout) # fast path if already decided
         if exc_info:
             raise exc_info[0], exc_info[1], exc_info[2]
         else:
@@ -525,6 +1844,290 @@ class Future(object):
     def __call__(self, timeout = None):
         return self.get(timeout)
 
+def _invokeCallback(callback, *args):
+    """
+    (internal) Invokes a callback and ignores exceptions
+    """
+    try:
+        callback(*args)
+    except:
+        sys.exc_clear()
+
+class _CompletionWaiter(object):
+    """
+    (internal) A completion notification which is shared by multiple Future objects.
+    The waiter must be closed after use, so that long-lived Future objects do not accumulate listeners of finished waits.
+    """
+    
+    def __init__(self, futures):
+        """
+        Initializer
+        
+        @param futures: Future objects to be observed
+        """
+        self.__condition = threading.Condition()
+        self.__completed = collections.deque()
+        self.__futures = futures
+        self.__listener = self.__onCompleted # the same object is removed by close
+        for future in futures:
+            future._addCompletionListener(self.__listener)
+    
+    def close(self):
+        """
+        Stops observing the Future objects which are not yet completed
+        """
+        for future in self.__futures:
+            if not future.completed:
+                future._removeCompletionListener(self.__listener)
+    
+    def __onCompleted(self, future):
+        with self.__condition:
+            self.__completed.append(future)
+            self.__condition.notify()
+    
+    def next(self, deadline = None):
+        """
+        Takes next completed Future object. This method may be blocking until any Future object is completed.
+        
+        @param deadline: a deadline in the form of time.time(), or None for no deadline
+        @return: a completed Future object, or None if the deadline has passed
+        """
+        with self.__condition:
+            while not self.__completed:
+                remaining = None if deadline is None else deadline - time.time()
+                if not remaining is None and remaining <= 0:
+                    return None
+                self.__condition.wait(remaining)
+            return self.__completed.popleft()
+
+def _uniqueFutures(futures):
+    """
+    (internal) Returns a list of unique Future objects in the order of appearance
+    """
+    seen = set()
+    unique = []
+    for future in futures:
+        if not isinstance(future, Future):
+            raise ValueError("%s is not a Future" % future)
+        if not future in seen:
+            seen.add(future)
+            unique.append(future)
+    return unique
+
+def asCompleted(futures, timeout = None):
+    """
+    Returns a generator which yields Future objects as soon as each one is completed.
+    All Future objects share one completion notification, so no thread waits per Future object.
+    
+    @param futures: an iterable of Future objects(duplicates are yielded once)
+    @param timeout: timeout in seconds for whole iteration from this invocation, or None for no timeout
+    @return: a generator of completed Future objects in the order of completion
+    @raise FutureError: (at the iteration) not all Future objects are completed before the timeout
+    """
+    futures = _uniqueFutures(futures)
+    deadline = None if timeout is None else time.time() + timeout
+    def _asCompleted():
+        waiter = _CompletionWaiter(futures) # created at the first iteration, so that the finally clause always closes it
+        try:
+            for i in xrange(len(futures)):
+                future = waiter.next(deadline)
+                if future is None:
+                    raise FutureError("%d of %d futures are not completed in %s seconds" % (len(futures) - i, len(futures), timeout))
+                yield future
+        finally:
+            waiter.close()
+    return _asCompleted()
+
+def waitAny(futures, timeout = None):
+    """
+    Waits until any one of the Future objects is completed.
+    
+    @param futures: an iterable of Future objects
+    @param timeout: timeout in seconds, or None for no timeout
+    @return: a completed Future object, or None if no Future objects are completed before the timeout
+    """
+    futures = _uniqueFutures(futures)
+    if not futures:
+        return None
+    deadline = None if timeout is None else time.time() + timeout
+    waiter = _CompletionWaiter(futures)
+    try:
+        return waiter.next(deadline)
+    finally:
+        waiter.close()
+
+def waitAll(futures, timeout = None):
+    """
+    Waits until all of the Future objects are completed.
+    
+    @param futures: an iterable of Future objects
+    @param timeout: timeout in seconds, or None for no timeout
+    @return: a pair of (a list of completed Future objects, a list of incomplete Future objects)
+    """
+    futures = _uniqueFutures(futures)
+    deadline = None if timeout is None else time.time() + timeout
+    waiter = _CompletionWaiter(futures)
+    completed = []
+    try:
+        for _ in xrange(len(futures)):
+            future = waiter.next(deadline)
+            if future is None:
+                break
+            completed.append(future)
+    finally:
+        waiter.close()
+    completedSet = set(completed)
+    return completed, [future for future in futures if not future in completedSet]
+
+class TaskGroup(object):
+    """
+    Structured group of tasks, which is used as a context manager.
+    On exit, the group waits for all members. The first failure of a member cancels the remaining members(fail-fast),
+    and the failures are raised together as TaskGroupError. An exception in the with-block also cancels the members, and it is raised after they are done.
+    Members which are not yet started are dropped by the cancellation, running members observe group.token(or cancellation of their own CancellableTask).
+    
+        with TaskGroup(executor) as group:
+            for url in urls:
+                group.submit(fetch, url, group.token)
+    """
+    
+    def __init__(self, executor, failFast = True, cancellationTokenSource = None, timeout = None):
+        """
+        Initializer
+        
+        @param executor: an Executor to perform member tasks
+        @param failFast: the first failure cancels the remaining members if True, or the members are performed independently if False
+        @param cancellationTokenSource: a parent CancellationTokenSource which cancels this group, or None
+        @param timeout: seconds until this group is cancelled automatically, or None
+        """
+        if not isinstance(executor, Executor):
+            raise ValueError("%s is not Executor" % executor)
+        self.__executor = executor
+        self.__failFast = failFast
+        self.__source = cancellationTokenSource.newChild(timeout) if not cancellationTokenSource is None else CancellationTokenSource(timeout)
+        self.__lock = threading.Lock()
+        self.__submitted = threading.Condition(self.__lock) # notified when a submission ends
+        self.__submitting = 0 # number of submissions in progress, which are performed without the lock
+        self.__futures = [] # holds strong references of Future objects, Task objects refer them by weakref
+        self.__excInfos = []
+        self.__closed = False
+        self.__source.register(self.__cancelMembers)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, excType, excValue, traceback):
+        if not excType is None:
+            self.__source.cancel()
+            self.join(False)
+            return False
+        self.join()
+        return False
+    
+    @property
+    def cancellationTokenSource(self):
+        """
+        CancellationTokenSource which is cancelled when this group is cancelled
+        """
+        return self.__source
+    
+    @property
+    def token(self):
+        """
+        CancellationToken which is observed by cooperative members
+        """
+        return self.__source.token
+    
+    @property
+    def futures(self):
+        """
+        A tuple of Future objects of the members in the order of submission
+        """
+        with self.__lock:
+            return tuple(self.__futures)
+    
+    @property
+    def cancelled(self):
+        """
+        True if this group is cancelled by a failure, the with-block, the parent or cancel()
+        """
+        return self.__source.isCancelled
+    
+    def submit(self, someCallable, *args, **kwds):
+        """
+        Submits a new member task into the Executor.
+        Members can be submitted until all members are done(i.e. members can submit members).
+        
+        @return: new Future object, which is already cancelled if this group is cancelled
+        @raise TaskError: this group is already closed
+        """
+        with self.__lock:
+            if self.__closed:
+                raise TaskError("Task group is already closed")
+            self.__submitting += 1 # join does not close this group until the submission ends
+        future = None
+        try:
+            # without the lock, because a bounded Executor may block while members complete(and take the lock in __onCompleted)
+            future = self.__executor.submit(someCallable, *args, **kwds)
+        finally:
+            with self.__lock:
+                self.__submitting -= 1
+                if not future is None:
+                    self.__futures.append(future)
+                self.__submitted.notifyAll()
+        future._addCompletionListener(self.__onCompleted)
+        if self.__source.isCancelled:
+            future.cancel() # cancelled while submitting
+        return future
+    
+    def cancel(self):
+        """
+        Cancels all members
+        
+        @return: True if cancelled by this invocation, False if already cancelled
+        """
+        return self.__source.cancel()
+    
+    def join(self, raises = True):
+        """
+        Waits for all members(including members which are submitted while waiting), and closes this group.
+        
+        @param raises: raises TaskGroupError if members failed
+        @raise TaskGroupError: members failed
+        """
+        while True:
+            with self.__lock:
+                pending = [future for future in self.__futures if not future.completed]
+                if not pending:
+                    if self.__submitting:
+                        self.__submitted.wait()
+                        continue
+                    self.__closed = True
+                    break
+            waitAll(pending)
+        self.__source.dispose()
+        if raises and self.__excInfos:
+            raise TaskGroupError(list(self.__excInfos))
+    
+    def __onCompleted(self, future):
+        """
+        (internal private) Records a failure of a member, and cancels the other members if fail-fast
+        """
+        excInfo = future.task.getSafe()[1]
+        if excInfo is None or issubclass(excInfo[0], TaskCancelledError):
+            return
+        with self.__lock:
+            self.__excInfos.append(excInfo)
+        if self.__failFast:
+            self.__source.cancel()
+    
+    def __cancelMembers(self, source):
+        """
+        (internal private) Cancels all members, invoked when the CancellationTokenSource is cancelled
+        """
+        for future in self.futures:
+            future.cancel()
+
 if __name__ == "__main__":
     ex = Executor(True, 10)
     def heavyTask(taskId):
@@ -535,7 +2138,7 @@ if __name__ == "__main__":
         return taskId
     futures = [ex.submit(heavyTask, i) for i in xrange(20)]
     terms = []
-    for f in futures:
+    for f in asCompleted(futures):
         terms.append(f.get())
         print terms
     print "TERMINATED, waiting"
@@ -551,6 +2154,13 @@ if __name__ == "__main__":
     t = Task(fooTask, 3, 2).then(fooTask, 2).then(fooTask, 1).then(fooTask, 0)
     print t.getSafe()
     
+    # fan-out/fan-in without blocking threads
+    source = ex.submit(fooTask, 6, 2)
+    branches = [source.thenAsync(fooTask, d, executor = ex) for d in (1, 2, 3)]
+    joined = ex.submit(lambda: sum(f.get() for f in branches))
+    joined.addDoneCallback(lambda f: sys.stdout.write("fan-in: %s\n" % f.get()))
+    waitAll([joined])
+    
     def yieldFunc():
         for x in xrange(10):
             print "x=%d" % x
@@ -560,14 +2170,30 @@ if __name__ == "__main__":
     f = ex.submit(StepwiseTask(yieldFunc))
     print f()
     
+    source = CancellationTokenSource()
     def infTask():
-        c = threading.Condition()
-        with c:
-            print "Awaiting"
-            c.wait()
-    f = ex.submit(infTask)
-    print f.get(0.5)
+        print "Awaiting"
+        while not source.isCancelled:
+            time.sleep(0.01)
+        return "Cancelled cooperatively"
+    f = ex.submit(CancellableTask(infTask, source))
+    time.sleep(0.5)
     f.cancel()
     print f.get()
     
+    def member(n, token):
+        for i in xrange(100):
+            if token.isCancelled:
+                return "stopped"
+            if n == 3 and i == 10:
+                raise ValueError("member %d failed" % n)
+            time.sleep(0.01)
+        return n
+    try:
+        with TaskGroup(ex) as group:
+            for n in xrange(20):
+                group.submit(member, n, group.token)
+    except TaskGroupError, e:
+        print e, [f.getSafe()[0] for f in group.futures]
+
 
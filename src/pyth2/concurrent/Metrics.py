@@ -0,0 +1,206 @@
+# encoding: utf-8
+'''
+Created on 2016/03/12
+
+@author: _
+'''
+import bisect
+import sys
+import threading
+
+from pyth2.concurrent.Concurrent import DeadlineExceededError, TaskCancelledError
+
+
+class Histogram(object):
+    """
+    Thread-safe histogram of durations(in seconds) with exponential buckets.
+    """
+    
+    BUCKET_BOUNDS = tuple(1e-6 * (2 ** i) for i in xrange(28)) # 1 usec .. about 134 sec
+    
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__buckets = [0] * (len(self.BUCKET_BOUNDS) + 1)
+        self.__count = 0
+        self.__sum = 0.0
+        self.__min = None
+        self.__max = None
+    
+    def record(self, value):
+        """
+        Records a value
+        
+        @param value: a duration in seconds
+        """
+        index = bisect.bisect_left(self.BUCKET_BOUNDS, value)
+        with self.__lock:
+            self.__buckets[index] += 1
+            self.__count += 1
+            self.__sum += value
+            if self.__min is None or value < self.__min:
+                self.__min = value
+            if self.__max is None or value > self.__max:
+                self.__max = value
+    
+    @property
+    def count(self):
+        return self.__count
+    
+    @property
+    def mean(self):
+        with self.__lock:
+            return self.__sum / self.__count if self.__count else None
+    
+    def percentile(self, ratio):
+        """
+        Returns an approximate percentile(upper bound of the bucket which contains the percentile)
+        
+        @param ratio: a ratio in [0, 1]
+        @return: a duration in seconds, or None if no values are recorded
+        """
+        with self.__lock:
+            if not self.__count:
+                return None
+            threshold = ratio * self.__count
+            accumulated = 0
+            for index, n in enumerate(self.__buckets):
+                accumulated += n
+                if accumulated >= threshold and n:
+                    return min(self.BUCKET_BOUNDS[index], self.__max) if index < len(self.BUCKET_BOUNDS) else self.__max
+            return self.__max
+    
+    def snapshot(self):
+        """
+        Returns a dict of count, mean, min, max, p50, p90 and p99
+        """
+        return {
+                "count": self.count,
+                "mean": self.mean,
+                "min": self.__min,
+                "max": self.__max,
+                "p50": self.percentile(0.5),
+                "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99),
+                }
+
+class ExecutorMetrics(object):
+    """
+    Instrumentation of Executor.
+    An instance is passed to Executor(metrics = ...), and collects counters and histograms of tasks and threads.
+    Events are also sent to the optional sink(forms like (lambda event, executor, subject: ..)) where the subject is a Task or a thread.
+    Events are "submitted", "finished", "yielded", "rejected", "threadCreated", "threadPurged" and "takeThreadBlocked".
+    Exceptions which are raised by the sink are counted as "sinkFailed" and ignored, so they never break submission nor worker threads.
+    """
+    
+    COUNTER_NAMES = ("submitted", "completed", "failed", "rejected", "deadlineExceeded", "cancelled", "yielded", "threadCreated", "threadPurged", "takeThreadBlocked", "sinkFailed")
+    
+    def __init__(self, sink = None):
+        """
+        Initializer
+        
+        @param sink: a function which receives events, or None
+        """
+        if not sink is None and not callable(sink):
+            raise ValueError("%s is not callable" % sink)
+        self.sink = sink
+        self.__lock = threading.Lock()
+        self.__counters = dict.fromkeys(self.COUNTER_NAMES, 0)
+        self.queueWait = Histogram() # enqueue -> start
+        self.runTime = Histogram() # start -> finish
+        self.takeThreadWait = Histogram() # time of waiting for a free thread
+    
+    def count(self, name, delta = 1):
+        """
+        Increments a counter
+        """
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + delta
+    
+    def counter(self, name):
+        """
+        Returns current value of a counter
+        """
+        return self.__counters.get(name, 0)
+    
+    def _emit(self, event, executor, subject):
+        if not self.sink is None:
+            try:
+                self.sink(event, executor, subject)
+            except:
+                sys.exc_clear()
+                self.count("sinkFailed")
+    
+    def taskSubmitted(self, executor, task):
+        self.count("submitted")
+        self._emit("submitted", executor, task)
+    
+    def taskRejected(self, executor, task):
+        self.count("rejected")
+        self._emit("rejected", executor, task)
+    
+    def taskPerformed(self, executor, task, resultPair):
+        """
+        Invoked after a thread performed a task
+        
+        @param resultPair: the value which is returned by the task, None if the task yielded the thread and is re-enqueued(e.g. TimeSlicedTask)
+        """
+        if resultPair is None:
+            self.count("yielded")
+            self._emit("yielded", executor, task)
+        else:
+            self.taskFinished(executor, task)
+    
+    def taskFinished(self, executor, task):
+        if not task.startedAt is None:
+            if not task.enqueuedAt is None:
+                self.queueWait.record(task.startedAt - task.enqueuedAt)
+            if not task.finishedAt is None:
+                self.runTime.record(task.finishedAt - task.startedAt)
+        excInfo = task.getSafe()[1]
+        if excInfo is None:
+            self.count("completed")
+        elif issubclass(excInfo[0], DeadlineExceededError):
+            self.count("deadlineExceeded")
+        elif issubclass(excInfo[0], TaskCancelledError):
+            self.count("cancelled")
+        else:
+            self.count("failed")
+        self._emit("finished", executor, task)
+    
+    def threadCreated(self, executor, thread):
+        self.count("threadCreated")
+        self._emit("threadCreated", executor, thread)
+    
+    def threadPurged(self, executor, thread):
+        self.count("threadPurged")
+        self._emit("threadPurged", executor, thread)
+    
+    def takeThreadBlocked(self, executor, waited):
+        self.count("takeThreadBlocked")
+        self.takeThreadWait.record(waited)
+        self._emit("takeThreadBlocked", executor, None)
+    
+    def snapshot(self):
+        """
+        Returns a dict of counters and histogram snapshots
+        """
+        with self.__lock:
+            result = dict(self.__counters)
+        result["queueWait"] = self.queueWait.snapshot()
+        result["runTime"] = self.runTime.snapshot()
+        result["takeThreadWait"] = self.takeThreadWait.snapshot()
+        return result
+    
+    def report(self):
+        """
+        Returns a human readable report
+        """
+        snapshot = self.snapshot()
+        lines = ["%-18s %d" % (name, snapshot[name]) for name in self.COUNTER_NAMES]
+        for name in ("queueWait", "runTime", "takeThreadWait"):
+            h = snapshot[name]
+            if h["count"]:
+                lines.append("%-18s n=%d mean=%.6f p50=%.6f p90=%.6f p99=%.6f max=%.6f" % (name, h["count"], h["mean"], h["p50"], h["p90"], h["p99"], h["max"]))
+            else:
+                lines.append("%-18s n=0" % name)
+        return "\n".join(lines)
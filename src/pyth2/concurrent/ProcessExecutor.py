@@ -0,0 +1,309 @@
+# encoding: utf-8
+'''
+Created on 2016/03/10
+
+@author: _
+'''
+import Queue
+import itertools
+import multiprocessing
+from multiprocessing.queues import SimpleQueue
+import os
+import sys
+import threading
+import traceback
+
+from pyth2.concurrent.Concurrent import Executor, Task, _putAll
+
+
+try:
+    import cPickle as pik
+except:
+    import pickle as pik
+
+
+DEFAULT_CHUNK_SIZE = 32 # maximum number of tasks which are sent to a worker process at once
+
+WATCHDOG_INTERVAL = 0.5 # seconds, interval of checking worker processes which died while performing chunks
+
+_startedChunks = None # (worker process) SimpleQueue which receives (chunk id, process id) when a chunk is started
+
+class RemoteTaskError(Exception):
+    """
+    Raised if an exception which is raised in a worker process cannot be sent back to the caller process.
+    """
+    pass
+
+def _portableExcInfo(excInfo):
+    """
+    (internal) Converts exc_info into a picklable form.
+    Traceback objects cannot be pickled, so the formatted traceback is attached to the exception as "remoteTraceback" attribute.
+    """
+    excType, excValue, excTrace = excInfo
+    formatted = "".join(traceback.format_exception(excType, excValue, excTrace))
+    try:
+        excValue.remoteTraceback = formatted
+        pik.loads(pik.dumps((excType, excValue), pik.HIGHEST_PROTOCOL))
+    except:
+        excType, excValue = RemoteTaskError, RemoteTaskError("%s: %s" % (excType.__name__, excValue))
+        excValue.remoteTraceback = formatted
+    return (excType, excValue, None)
+
+def _initWorker(startedChunks):
+    """
+    (internal) Initializes a worker process
+    """
+    global _startedChunks
+    _startedChunks = startedChunks
+
+def _performChunk(chunkId, payloads):
+    """
+    (internal) Performs pickled tasks in a worker process.
+    
+    @param chunkId: an id of the chunk, which is reported to the watchdog of the caller process before performing the tasks
+    @param payloads: a list of pickled tuples of (function, args, kwds, then-clauses)
+    @return: a list of pickled pairs of (task result, exc_info)
+    """
+    if not _startedChunks is None:
+        _startedChunks.put((chunkId, os.getpid())) # SimpleQueue writes synchronously, so the report survives a crash of this process
+    results = []
+    for payload in payloads:
+        try:
+            function, args, kwds, thenClauses = pik.loads(payload)
+            partialResult = function(*args, **kwds)
+            for thenBody, thenArgs, thenKwds in thenClauses:
+                partialResult = thenBody(partialResult, *thenArgs, **thenKwds)
+            resultPair = (partialResult, None)
+        except:
+            resultPair = (None, _portableExcInfo(sys.exc_info()))
+            sys.exc_clear()
+        try:
+            results.append(pik.dumps(resultPair, pik.HIGHEST_PROTOCOL))
+        except:
+            results.append(pik.dumps((None, _portableExcInfo(sys.exc_info())), pik.HIGHEST_PROTOCOL))
+            sys.exc_clear()
+    return results
+
+class ProcessExecutor(Executor):
+    """
+    Process-pool based executor.
+    Tasks(including then-clauses) are performed in worker processes and the results are sent back to the Future objects in this process,
+    so CPU-bound tasks are not limited by GIL.
+    Task bodies, arguments and results must be picklable(i.e. module level functions, not lambdas or closures).
+    Exceptions are sent back in the form of (exception type, exception, None), the formatted remote traceback is available as "remoteTraceback" attribute of the exception.
+    If a worker process dies while performing a chunk(e.g. killed or crashed), a watchdog thread fails the tasks of the chunk with RemoteTaskError instead of leaving them incomplete.
+    Only tasks which are not yet sent to worker processes can be cancelled. Cancellation of a sent task is merely requested(Task.cancel returns True),
+    the task is performed remotely and decided by its results.
+    """
+    
+    def __init__(self, poolMaxSize = None, unhandledExceptionHandler = None, taskType = None, chunkSize = DEFAULT_CHUNK_SIZE):
+        """
+        Initializer
+        
+        @param poolMaxSize: number of worker processes, or multiprocessing.cpu_count() if None
+        @param unhandledExceptionHandler: a function which is invoked at a task cannot be sent to worker processes(forms like (lambda executor, task: ..)), or ignored if None
+        @param taskType: subtype of Task which is used for creation of new Task
+        @param chunkSize: maximum number of tasks which are sent to a worker process at once. Tasks which are queued at the same time are batched into a chunk.
+        """
+        if int(chunkSize) <= 0:
+            raise ValueError("Chunk size must be more than 0")
+        self.__chunkSize = int(chunkSize)
+        self.__processes = int(poolMaxSize) if not poolMaxSize is None else multiprocessing.cpu_count()
+        super(ProcessExecutor, self).__init__(True, poolMaxSize, unhandledExceptionHandler, taskType)
+    
+    def _startScheduler(self, workStealing):
+        if workStealing:
+            raise ValueError("ProcessExecutor does not support work-stealing mode")
+        self.__submitted = Queue.Queue()
+        self.__startedChunks = SimpleQueue()
+        self.__processPool = multiprocessing.Pool(self.__processes, _initWorker, (self.__startedChunks,))
+        self.__chunkIds = itertools.count()
+        self.__chunks = {} # chunk id -> [tasks, AsyncResult], chunks which are sent and not yet completed
+        self.__chunksCondition = threading.Condition()
+        self.__lost = False # True if a worker process died while performing a chunk
+        self.__stopped = threading.Event()
+        self.__dispatcher = threading.Thread(target = self.__dispatch)
+        self.__dispatcher.daemon = True
+        self.__dispatcher.start()
+        self.__watchdog = threading.Thread(target = self.__watch)
+        self.__watchdog.daemon = True
+        self.__watchdog.start()
+    
+    def _schedule(self, task):
+        self.__submitted.put(task)
+    
+    def _scheduleMany(self, tasks):
+        _putAll(self.__submitted, tasks)
+    
+    @property
+    def chunkSize(self):
+        """
+        Maximum number of tasks which are sent to a worker process at once
+        """
+        return self.__chunkSize
+    
+    def shutdown(self):
+        """
+        Stops accepting tasks after already submitted tasks, and waits for termination of worker processes.
+        """
+        self.__submitted.put(None)
+        self.__dispatcher.join()
+        self.__processPool.close()
+        with self.__chunksCondition:
+            while self.__chunks:
+                self.__chunksCondition.wait()
+        self.__stopped.set()
+        self.__watchdog.join()
+        if self.__lost:
+            self.__processPool.terminate() # the pool never finishes the lost chunks, so join would wait forever
+        self.__processPool.join()
+    
+    def __takeChunk(self):
+        """
+        (internal private) Takes next tasks up to chunkSize. Blocks until the first task is available.
+        
+        @return: a list of tasks, the last element is None if shutdown is requested
+        """
+        chunk = [self.__submitted.get()]
+        while len(chunk) < self.__chunkSize and not chunk[-1] is None:
+            try:
+                chunk.append(self.__submitted.get_nowait())
+            except Queue.Empty:
+                break
+        return chunk
+    
+    def __dispatch(self):
+        """
+        (internal private) Pickles queued tasks and sends them to worker processes in chunks
+        """
+        while True:
+            chunk = self.__takeChunk()
+            terminated = chunk[-1] is None
+            tasks = []
+            payloads = []
+            for task in chunk if not terminated else chunk[:-1]:
+                if not task._begin() is None:
+                    continue # cancelled or the deadline has passed
+                # the dispatcher is the runner from here on, so cancellation no longer decides the task locally while it is performed remotely
+                try:
+                    payloads.append(pik.dumps((task.function, task.args, task.kwds, task._thenClauses()), pik.HIGHEST_PROTOCOL))
+                    tasks.append(task)
+                except:
+                    task._complete((None, sys.exc_info()))
+                    sys.exc_clear()
+                    if callable(self.unhandledExceptionHandler):
+                        self.unhandledExceptionHandler(self, task)
+            if tasks:
+                chunkId = self.__chunkIds.next()
+                entry = [tasks, None]
+                with self.__chunksCondition:
+                    self.__chunks[chunkId] = entry # before sending, the callback may be invoked before apply_async returns
+                entry[1] = self.__processPool.apply_async(_performChunk, (chunkId, payloads), callback = lambda results, chunkId = chunkId: self.__completeChunk(chunkId, results))
+            if terminated:
+                return
+    
+    def __takeEntry(self, chunkId):
+        """
+        (internal private) Removes a chunk which is completed or failed
+        
+        @return: the entry of the chunk, or None if already removed
+        """
+        with self.__chunksCondition:
+            entry = self.__chunks.pop(chunkId, None)
+            self.__chunksCondition.notifyAll()
+            return entry
+    
+    def __completeChunk(self, chunkId, results):
+        """
+        (internal private) Decides results of the tasks by pickled results from a worker process.
+        This method is invoked in the result handler thread of the pool, so it must not raise.
+        """
+        entry = self.__takeEntry(chunkId)
+        if entry is None:
+            return # failed by the watchdog
+        tasks = entry[0]
+        try:
+            for task, result in zip(tasks, results):
+                try:
+                    resultPair = pik.loads(result)
+                except:
+                    resultPair = (None, sys.exc_info())
+                    sys.exc_clear()
+                task._complete(resultPair)
+            if len(results) < len(tasks):
+                raise RemoteTaskError("%d results are missing" % (len(tasks) - len(results)))
+        except:
+            self.__failChunk(tasks, sys.exc_info())
+            sys.exc_clear()
+    
+    def __failChunk(self, tasks, excInfo):
+        """
+        (internal private) Fails the tasks of a chunk which are not yet decided
+        """
+        for task in tasks:
+            try:
+                task._complete((None, excInfo))
+            except:
+                sys.exc_clear()
+    
+    def __watch(self):
+        """
+        (internal private) Fails chunks whose worker process died, or whose AsyncResult failed without invoking the callback
+        """
+        workers = {} # chunk id -> process id
+        while not self.__stopped.wait(WATCHDOG_INTERVAL):
+            with self.__chunksCondition:
+                chunks = self.__chunks.items()
+            while not self.__startedChunks.empty():
+                chunkId, pid = self.__startedChunks.get()
+                workers[chunkId] = pid
+            alive = set(p.pid for p in multiprocessing.active_children())
+            for chunkId, (tasks, asyncResult) in chunks:
+                if asyncResult is None:
+                    continue # being sent
+                pid = workers.get(chunkId)
+                if asyncResult.ready():
+                    if asyncResult.successful():
+                        continue # the callback decides the results
+                    try:
+                        asyncResult.get()
+                    except:
+                        if not self.__takeEntry(chunkId) is None:
+                            self.__failChunk(tasks, sys.exc_info())
+                        sys.exc_clear()
+                elif not pid is None and not pid in alive and not asyncResult.wait(WATCHDOG_INTERVAL): # the results may be arriving
+                    if not self.__takeEntry(chunkId) is None:
+                        self.__lost = True
+                        self.__failChunk(tasks, (RemoteTaskError, RemoteTaskError("Worker process %d died while performing the task" % pid), None))
+            for chunkId in [chunkId for chunkId in workers if not chunkId in self.__chunks]:
+                del workers[chunkId]
+
+def _hanoi(n, start, end, work):
+    if n > 0:
+        k = _hanoi(n - 1, start, work, end)
+        return _hanoi(n - 1, work, end, start) + k + 1
+    return 0
+
+if __name__ == "__main__":
+    import time
+    
+    def hanoiMachine(executor):
+        t = time.time()
+        print [f.get() for f in [executor.submit(_hanoi, n, "A", "B", "C") for n in xrange(20, 0, -1)]]
+        return time.time() - t
+    print "threads:   %f sec" % hanoiMachine(Executor(True, 20))
+    processExecutor = ProcessExecutor()
+    print "processes: %f sec" % hanoiMachine(processExecutor)
+    
+    f = processExecutor.submit(divmod, 7, 0)
+    try:
+        f.get()
+    except ZeroDivisionError, e:
+        print "remote exception: %r" % e
+        print e.remoteTraceback
+    print processExecutor.submit(Task(divmod, 7, 2).then(sum)).get()
+    try:
+        processExecutor.submit(os._exit, 1).get()
+    except RemoteTaskError, e:
+        print "lost: %s" % e
+    processExecutor.shutdown()
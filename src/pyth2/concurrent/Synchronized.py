@@ -5,22 +5,200 @@ Created on 2016/02/09
 @author: _
 '''
 
+import collections
+import inspect
+import sys
 import threading
+import time
 
-from pyth2.deco.Decorators import ConsProxy
+from pyth2.concurrent.Metrics import Histogram
+from pyth2.deco.Decorators import ConsProxy, getOriginalDecoratee
 
 
-class SynchronizedInvocator(object):
+DEFAULT_STRIPES = 16 # number of locks of StripedLock
+
+CONTENTION_PROFILING_ENABLED = False # True to profile all synchronized functions which are not decorated with profiled = False
+
+_contentionProfiles = {} # (module, name, first line) -> ContentionProfile
+
+_contentionProfilesLock = threading.Lock()
+
+_contentionProfilesGeneration = 0 # incremented by resetContentionProfiles, so that invocators drop their cached profiles
+
+def _callSite(depth):
+    """
+    (internal) Returns the call site of the frame at the depth in the form of "file:line(function)"
+    """
+    frame = sys._getframe(depth + 1)
+    return "%s:%d(%s)" % (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+
+class ContentionProfile(object):
+    """
+    Contention statistics of a synchronized function.
+    Wait time is the time to acquire the lock, hold time is the time between acquisition and release,
+    queue length is the number of threads waiting for the lock(including the caller) when the caller is blocked.
+    Contended acquisitions are attributed to the call site which held the lock at that time.
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.contended = 0 # number of calls which are blocked at acquisition
+        self.maxQueueLength = 0
+        self.queueLengthSum = 0 # sum of queue lengths of contended calls
+        self.waitTime = Histogram()
+        self.holdTime = Histogram()
+        self.blockingSites = collections.Counter() # call site of the holder -> number of blocked calls
+        self.holdTimeBySite = collections.defaultdict(float) # call site -> total hold time in seconds
+        self.__statsLock = threading.Lock()
+        self.__waiting = 0
+        self.__owner = None
     
-    def __init__(self, annotatee, condition = None):
+    def acquire(self, lock, site):
+        """
+        Acquires the lock with recording statistics
+        
+        @param site: call site of the caller
+        @return: a token which is passed to release
+        """
+        queueLength = 0
+        waited = 0.0
+        if not lock.acquire(False):
+            with self.__statsLock:
+                self.__waiting += 1
+                queueLength = self.__waiting
+                blocker = self.__owner
+            begin = time.time()
+            lock.acquire()
+            waited = time.time() - begin
+            with self.__statsLock:
+                self.__waiting -= 1
+                self.contended += 1
+                self.queueLengthSum += queueLength
+                self.maxQueueLength = max(self.maxQueueLength, queueLength)
+                self.blockingSites[blocker] += 1
+        with self.__statsLock:
+            self.calls += 1
+            previousOwner, self.__owner = self.__owner, site
+        self.waitTime.record(waited)
+        return (time.time(), previousOwner, site)
+    
+    def release(self, lock, token):
+        """
+        Releases the lock with recording statistics
+        
+        @param token: the token which is returned by acquire
+        """
+        acquiredAt, previousOwner, site = token
+        held = time.time() - acquiredAt
+        with self.__statsLock:
+            self.__owner = previousOwner # restores the outer owner of reentrant locks
+            self.holdTimeBySite[site] += held
+        self.holdTime.record(held)
+        lock.release()
+    
+    def report(self, top = 3):
+        """
+        Returns a human readable report
+        
+        @param top: number of call sites which are listed
+        """
+        wait = self.waitTime.snapshot()
+        hold = self.holdTime.snapshot()
+        lines = ["%s calls=%d contended=%d(%.1f%%) queue mean=%.2f max=%d" % (
+                 self.name, self.calls, self.contended, 100.0 * self.contended / self.calls if self.calls else 0.0,
+                 float(self.queueLengthSum) / self.contended if self.contended else 0.0, self.maxQueueLength)]
+        for label, h in (("wait", wait), ("hold", hold)):
+            if h["count"]:
+                lines.append("  %s total=%.6f mean=%.6f p99=%.6f max=%.6f" % (label, h["mean"] * h["count"], h["mean"], h["p99"], h["max"]))
+        for site, count in self.blockingSites.most_common(top):
+            lines.append("  blocked %d calls while held by %s" % (count, site))
+        for site, held in sorted(self.holdTimeBySite.items(), key = lambda e: -e[1])[:top]:
+            lines.append("  held %.6f sec by %s" % (held, site))
+        return "\n".join(lines)
+
+def contentionProfiles():
+    """
+    Returns a list of ContentionProfile objects of profiled synchronized functions
+    """
+    with _contentionProfilesLock:
+        return list(_contentionProfiles.values())
+
+def contentionReport(top = 3):
+    """
+    Returns a human readable report of all profiled synchronized functions, sorted by total wait time
+    
+    @param top: number of call sites which are listed for each function
+    """
+    profiles = sorted(contentionProfiles(), key = lambda p: -(p.waitTime.mean or 0.0) * p.waitTime.count)
+    return "\n".join(p.report(top) for p in profiles)
+
+def resetContentionProfiles():
+    """
+    Discards all statistics
+    """
+    global _contentionProfilesGeneration
+    with _contentionProfilesLock:
+        for key in _contentionProfiles:
+            _contentionProfiles[key] = ContentionProfile(_contentionProfiles[key].name)
+        _contentionProfilesGeneration += 1
+
+
+class SynchronizedInvocator(object):
+
+    def __init__(self, annotatee, condition = None, profiled = None):
+        """
+        Initializer
+        
+        @param condition: a lock(or threading.Condition) to share with other functions, or None to create a new threading.Condition
+        @param profiled: True to record ContentionProfile, False not to record, None to follow CONTENTION_PROFILING_ENABLED
+        """
         self.__func = annotatee
-        self.__lock = threading.Condition() if not isinstance(condition, threading.Condition) else condition
+        self.__lock = threading.Condition() if condition is None else condition # threading.Condition is a factory function, not a type
+        self.__profiled = profiled
+        original = getOriginalDecoratee(annotatee)
+        code = getattr(original, "func_code", None)
+        self.__profileKey = (getattr(original, "__module__", None), getattr(original, "__name__", repr(original)), code.co_firstlineno if code else None)
+        self.__cachedProfile = (-1, None) # (generation, ContentionProfile), looked up once per generation
     
     @property
     def lock(self):
         return self.__lock
     
+    @property
+    def profile(self):
+        """
+        ContentionProfile of this function, or None if not yet profiled
+        """
+        with _contentionProfilesLock:
+            return _contentionProfiles.get(self.__profileKey)
+    
+    def __profile(self):
+        """
+        (internal private) Returns ContentionProfile to record, or None if not profiled.
+        The profile is cached on this invocator, so that profiled calls do not serialize on the global lock of the profiles.
+        """
+        if not (self.__profiled or self.__profiled is None and CONTENTION_PROFILING_ENABLED):
+            return None
+        generation, profile = self.__cachedProfile
+        if generation == _contentionProfilesGeneration:
+            return profile
+        with _contentionProfilesLock:
+            profile = _contentionProfiles.get(self.__profileKey)
+            if profile is None:
+                module, name, line = self.__profileKey
+                profile = _contentionProfiles[self.__profileKey] = ContentionProfile("%s.%s(line %s)" % (module, name, line))
+            self.__cachedProfile = (_contentionProfilesGeneration, profile)
+            return profile
+    
     def __call__(self, *args, **kwds):
+        profile = self.__profile()
+        if not profile is None:
+            token = profile.acquire(self.__lock, _callSite(2)) # 1: decorator's wrapper, 2: caller
+            try:
+                return self.__func(*args, **kwds)
+            finally:
+                profile.release(self.__lock, token)
         try:
             self.__lock.acquire()
             return self.__func(*args, **kwds)
@@ -29,7 +207,7 @@ class SynchronizedInvocator(object):
     
     def __enter__(self):
         self.__lock.acquire()
-        
+    
     def __exit__(self, exc_type, exc_instance, exc_trace): # @UnusedVariable
         try:
             if exc_instance:
@@ -38,3 +216,202 @@ class SynchronizedInvocator(object):
             self.__lock.release()
 
 synchronized = ConsProxy(SynchronizedInvocator) # synchronized decorator
+
+class ReadWriteLock(object):
+    """
+    Writer-preferring read/write lock.
+    Readers share the lock while no writer holds or waits for it, so a stream of readers never starves writers.
+    Both read and write locks are reentrant, and the writer can also take the read lock. Upgrading read lock to write lock is not allowed.
+    """
+    
+    class _Side(object):
+        """
+        (internal) A context manager of read or write side of ReadWriteLock
+        """
+        def __init__(self, acquire, release):
+            self.acquire = acquire
+            self.release = release
+        
+        def __enter__(self):
+            self.acquire()
+        
+        def __exit__(self, exc_type, exc_instance, exc_trace): # @UnusedVariable
+            self.release()
+    
+    def __init__(self):
+        self.__condition = threading.Condition(threading.Lock())
+        self.__readers = 0 # number of read holds
+        self.__writer = None # thread which holds the write lock
+        self.__writeHolds = 0
+        self.__waitingWriters = 0
+        self.__local = threading.local() # read holds of each thread
+        self.readLock = ReadWriteLock._Side(self.acquireRead, self.releaseRead)
+        self.writeLock = ReadWriteLock._Side(self.acquireWrite, self.releaseWrite)
+    
+    def __readHolds(self):
+        return getattr(self.__local, "holds", 0)
+    
+    def acquireRead(self):
+        """
+        Acquires the read lock, blocks while a writer holds or waits for the lock
+        """
+        holds = self.__readHolds()
+        with self.__condition:
+            if holds == 0 and not self.__writer is threading.currentThread():
+                while not self.__writer is None or self.__waitingWriters:
+                    self.__condition.wait()
+            self.__readers += 1
+        self.__local.holds = holds + 1
+    
+    def releaseRead(self):
+        """
+        Releases the read lock
+        """
+        holds = self.__readHolds()
+        if holds == 0:
+            raise RuntimeError("cannot release un-acquired read lock")
+        self.__local.holds = holds - 1
+        with self.__condition:
+            self.__readers -= 1
+            if self.__readers == 0:
+                self.__condition.notifyAll()
+    
+    def acquireWrite(self):
+        """
+        Acquires the write lock, blocks while other threads hold the lock
+        
+        @raise RuntimeError: the caller thread holds the read lock
+        """
+        me = threading.currentThread()
+        with self.__condition:
+            if self.__writer is me:
+                self.__writeHolds += 1
+                return
+            if self.__readHolds():
+                raise RuntimeError("cannot upgrade read lock to write lock")
+            self.__waitingWriters += 1
+            try:
+                while not self.__writer is None or self.__readers:
+                    self.__condition.wait()
+            finally:
+                self.__waitingWriters -= 1
+            self.__writer = me
+            self.__writeHolds = 1
+    
+    def releaseWrite(self):
+        """
+        Releases the write lock
+        """
+        with self.__condition:
+            if not self.__writer is threading.currentThread():
+                raise RuntimeError("cannot release un-acquired write lock")
+            self.__writeHolds -= 1
+            if self.__writeHolds == 0:
+                self.__writer = None
+                self.__condition.notifyAll()
+
+class ReadLockedInvocator(object):
+
+    def __init__(self, annotatee, rwLock):
+        if not isinstance(rwLock, ReadWriteLock):
+            raise ValueError("%s is not ReadWriteLock" % rwLock)
+        self.__func = annotatee
+        self.__lock = rwLock
+    
+    @property
+    def lock(self):
+        return self.__lock
+    
+    def __call__(self, *args, **kwds):
+        self.__lock.acquireRead()
+        try:
+            return self.__func(*args, **kwds)
+        finally:
+            self.__lock.releaseRead()
+
+class WriteLockedInvocator(object):
+
+    def __init__(self, annotatee, rwLock):
+        if not isinstance(rwLock, ReadWriteLock):
+            raise ValueError("%s is not ReadWriteLock" % rwLock)
+        self.__func = annotatee
+        self.__lock = rwLock
+    
+    @property
+    def lock(self):
+        return self.__lock
+    
+    def __call__(self, *args, **kwds):
+        self.__lock.acquireWrite()
+        try:
+            return self.__func(*args, **kwds)
+        finally:
+            self.__lock.releaseWrite()
+
+readLocked = ConsProxy(ReadLockedInvocator) # shares the ReadWriteLock with other readers, e.g. @readLocked(cacheLock)
+writeLocked = ConsProxy(WriteLockedInvocator) # excludes all readers and writers of the ReadWriteLock, e.g. @writeLocked(cacheLock)
+
+class StripedLock(object):
+    """
+    A fixed set of locks which are selected by hash of keys.
+    Operations on unrelated keys run concurrently unless the keys collide on a stripe, operations on the same key are serialized.
+    """
+    
+    def __init__(self, stripes = DEFAULT_STRIPES, lockType = threading.RLock):
+        """
+        Initializer
+        
+        @param stripes: number of locks
+        @param lockType: a function which creates a lock
+        """
+        if int(stripes) <= 0:
+            raise ValueError("Stripes must be more than 0: %d" % stripes)
+        self.__locks = tuple(lockType() for _ in xrange(int(stripes)))
+    
+    @property
+    def stripes(self):
+        return len(self.__locks)
+    
+    def lockFor(self, key):
+        """
+        Returns the lock of the key
+        """
+        return self.__locks[hash(key) % len(self.__locks)]
+
+class StripedInvocator(object):
+
+    def __init__(self, annotatee, key = 0, stripedLock = None):
+        """
+        Initializer
+        
+        @param key: position(int) or name(str) of the argument whose hash selects the lock
+        @param stripedLock: StripedLock object to share with other functions, or None to create a new StripedLock
+        """
+        self.__func = annotatee
+        self.__lock = stripedLock if not stripedLock is None else StripedLock()
+        if not isinstance(self.__lock, StripedLock):
+            raise ValueError("%s is not StripedLock" % stripedLock)
+        self.__original = getOriginalDecoratee(annotatee)
+        argNames = inspect.getargspec(self.__original).args
+        if isinstance(key, basestring):
+            if not key in argNames:
+                raise ValueError("%s has no argument %s" % (annotatee, key))
+            self.__keyIndex, self.__keyName = argNames.index(key), key
+        else:
+            self.__keyIndex, self.__keyName = int(key), argNames[int(key)] if int(key) < len(argNames) else None
+    
+    @property
+    def lock(self):
+        return self.__lock
+    
+    def __call__(self, *args, **kwds):
+        if self.__keyIndex < len(args):
+            key = args[self.__keyIndex]
+        elif self.__keyName in kwds:
+            key = kwds[self.__keyName]
+        else:
+            key = inspect.getcallargs(self.__original, *args, **kwds)[self.__keyName] # the default value, or TypeError if the argument is missing
+        with self.__lock.lockFor(key):
+            return self.__func(*args, **kwds)
+
+striped = ConsProxy(StripedInvocator) # synchronizes calls which have the same key argument, e.g. @striped("userId")
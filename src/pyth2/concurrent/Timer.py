@@ -3,38 +3,426 @@ Created on 2016/03/06
 
 @author: _
 '''
+import collections
+import ctypes
+import ctypes.util
+import math
+import sys
+import threading
 import time
 
-from pyth2.concurrent.Concurrent import StepwiseTask, Executor
+from pyth2.concurrent.Concurrent import StepwiseTask, Executor, _invokeCallback
+from pyth2.enum.SafeEnum import enumOf
 from datetime import datetime
 
 
+DEFAULT_TICK_DURATION = 0.005 # seconds, resolution of TimerWheel
+
+DEFAULT_WHEEL_SIZE = 512 # number of buckets of TimerWheel
+
+MissedTickPolicy = enumOf(int,
+                          SKIP = 0, # skips missed ticks, the next tick is the next deadline in the future
+                          COALESCE = 1, # performs one tick immediately for all missed ticks
+                          BURST = 2) # performs all missed ticks back-to-back until catching up
+
+_CLOCK_MONOTONIC = {"linux": 1, "darwin": 6, "freebsd": 4}
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+def _monotonicClock():
+    """
+    (internal) Returns a function which returns seconds of a monotonic clock.
+    clock_gettime(CLOCK_MONOTONIC) is used through ctypes if available, or time.time is used otherwise(not monotonic).
+    """
+    if hasattr(time, "monotonic"):
+        return time.monotonic
+    try:
+        clockId = next(v for k, v in _CLOCK_MONOTONIC.items() if sys.platform.startswith(k))
+        libc = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"), use_errno = True)
+        clockGettime = libc.clock_gettime
+        clockGettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+        def monotonic():
+            spec = _Timespec()
+            if clockGettime(clockId, ctypes.byref(spec)) != 0:
+                raise OSError(ctypes.get_errno(), "clock_gettime failed")
+            return spec.tv_sec + spec.tv_nsec * 1e-9
+        monotonic()
+        return monotonic
+    except:
+        sys.exc_clear()
+        return time.time
+
+monotonic = _monotonicClock() # seconds from an arbitrary point, which is not affected by system clock updates
+
 class Timer(object):
     pass
 
+class TimerHandle(object):
+    """
+    A timer which is scheduled on a TimerWheel.
+    The handler is invoked in the form of (handler(timerHandle, *args, **kwds)).
+    """
+    
+    def __init__(self, wheel, deadline, period, fixedRate, handler, args, kwds, executor):
+        """
+        Initializer(created by TimerWheel)
+        
+        @param deadline: next expiration time(in the form of monotonic())
+        @param period: seconds between expirations, or None for one-shot timer
+        @param fixedRate: True if next deadline is counted from previous deadline, False if counted from completion of the handler
+        """
+        self.__wheel = wheel
+        self.deadline = deadline
+        self.period = period
+        self.fixedRate = fixedRate
+        self.handler = handler
+        self.args = args
+        self.kwds = kwds
+        self.executor = executor
+        self.runs = 0 # number of invocations of the handler
+        self.missed = 0 # number of expirations which are skipped because the handler was overrunning
+        self.rounds = 0 # (internal) remaining rotations of the wheel
+        self.__cancelled = False
+        self.__running = False
+    
+    @property
+    def periodic(self):
+        return not self.period is None
+    
+    @property
+    def cancelled(self):
+        return self.__cancelled
+    
+    @property
+    def running(self):
+        """
+        True while the handler is performed
+        """
+        return self.__running
+    
+    def cancel(self):
+        """
+        Cancels this timer. A running handler is not interrupted, but the timer never expires after that.
+        
+        @return: True if cancelled by this invocation, False if already cancelled or done
+        """
+        return self.__wheel._cancel(self)
+    
+    def _markCancelled(self):
+        self.__cancelled = True
+    
+    def _expire(self, now):
+        """
+        (internal) Invoked by the wheel thread at the deadline.
+        The handler is submitted without blocking, so that a saturated Executor never stalls the wheel thread. A rejected expiration is counted as missed.
+        
+        @return: True if the handler is dispatched, False if skipped because the previous invocation is still running or the Executor rejected it
+        """
+        if self.__running:
+            self.missed += 1
+            return False
+        self.__running = True
+        if self.executor is None:
+            self.__perform()
+            return True
+        try:
+            self.executor._trySubmit(self.__perform)
+        except:
+            sys.exc_clear() # e.g. RejectedExecutionError, which must not kill the wheel thread
+            self.__running = False
+            self.missed += 1
+            if self.periodic and not self.fixedRate and not self.__cancelled:
+                self.deadline = now + self.period # __perform does not reschedule it
+                self.__wheel._reschedule(self)
+            return False
+        return True
+    
+    def __perform(self):
+        """
+        (internal private) Performs the handler, and reschedules fixed-delay timer after that
+        """
+        try:
+            self.runs += 1
+            _invokeCallback(self.handler, self, *self.args, **self.kwds)
+        finally:
+            self.__running = False
+        if self.periodic and not self.fixedRate and not self.__cancelled:
+            self.deadline = monotonic() + self.period
+            self.__wheel._reschedule(self)
+    
+    def __repr__(self):
+        return "<TimerHandle deadline=%r period=%r fixedRate=%r runs=%d missed=%d cancelled=%r>" % (self.deadline, self.period, self.fixedRate, self.runs, self.missed, self.__cancelled)
+
+class TimerWheel(object):
+    """
+    Timer service based on a hashed timing wheel, which is driven by one thread.
+    Timers are hashed into wheelSize buckets by their deadlines in units of tickDuration, so scheduling and cancellation are O(1) and
+    the thread touches only one bucket per tick. Timers expire at most one tickDuration late, never early.
+    The thread sleeps while no timers are scheduled.
+    Handlers are performed on the wheel thread(must be short), or dispatched onto an Executor.
+    """
+    
+    def __init__(self, tickDuration = DEFAULT_TICK_DURATION, wheelSize = DEFAULT_WHEEL_SIZE, executor = None, daemonize = True):
+        """
+        Initializer
+        
+        @param tickDuration: resolution in seconds
+        @param wheelSize: number of buckets, timers which are farther than tickDuration * wheelSize survive some rotations
+        @param executor: default Executor to perform handlers, or None to perform handlers on the wheel thread
+        @param daemonize: True if the wheel thread is a daemon thread
+        """
+        if tickDuration <= 0:
+            raise ValueError("Tick duration must be more than 0: %f" % tickDuration)
+        if int(wheelSize) <= 0:
+            raise ValueError("Wheel size must be more than 0: %d" % wheelSize)
+        if not executor is None and not isinstance(executor, Executor):
+            raise ValueError("%s is not Executor" % executor)
+        self.__tickDuration = float(tickDuration)
+        self.__wheel = [[] for _ in xrange(int(wheelSize))]
+        self.__executor = executor
+        self.__pending = collections.deque() # timers which are scheduled by other threads
+        self.__condition = threading.Condition()
+        self.__active = 0 # number of timers which are neither cancelled nor done
+        self.__terminated = False
+        self.__thread = threading.Thread(target = self.__run)
+        self.__thread.daemon = daemonize
+        self.__thread.start()
+    
+    @property
+    def tickDuration(self):
+        return self.__tickDuration
+    
+    @property
+    def wheelSize(self):
+        return len(self.__wheel)
+    
+    @property
+    def activeCount(self):
+        """
+        Number of timers which are neither cancelled nor done
+        """
+        return self.__active
+    
+    def schedule(self, delay, handler, args = (), kwds = None, executor = None):
+        """
+        Schedules an one-shot timer
+        
+        @param delay: seconds until expiration
+        @param handler: a function(forms like (lambda timerHandle, *args, **kwds: ..))
+        @param executor: an Executor to perform the handler, or None for the default of this wheel
+        @return: TimerHandle object
+        """
+        return self.__add(delay, None, False, handler, args, kwds, executor)
+    
+    def scheduleAtFixedRate(self, initialDelay, period, handler, args = (), kwds = None, executor = None):
+        """
+        Schedules a periodic timer whose deadlines are initialDelay + n * period(no drift is accumulated).
+        Expirations are skipped(and counted as TimerHandle.missed) while the previous invocation is running.
+        
+        @return: TimerHandle object
+        @see: schedule
+        """
+        return self.__add(initialDelay, period, True, handler, args, kwds, executor)
+    
+    def scheduleWithFixedDelay(self, initialDelay, delay, handler, args = (), kwds = None, executor = None):
+        """
+        Schedules a periodic timer whose next deadline is delay seconds after completion of the handler
+        
+        @return: TimerHandle object
+        @see: schedule
+        """
+        return self.__add(initialDelay, delay, False, handler, args, kwds, executor)
+    
+    def shutdown(self):
+        """
+        Stops the wheel thread. Timers which are not yet expired are discarded.
+        """
+        with self.__condition:
+            self.__terminated = True
+            self.__condition.notifyAll()
+        if not self.__thread is threading.currentThread():
+            self.__thread.join()
+    
+    def __add(self, delay, period, fixedRate, handler, args, kwds, executor):
+        """
+        (internal private) Creates and enqueues new TimerHandle
+        """
+        if not callable(handler):
+            raise ValueError("%s is not callable" % handler)
+        if not period is None and period <= 0:
+            raise ValueError("Period must be more than 0: %f" % period)
+        handle = TimerHandle(self, monotonic() + max(0.0, delay), period, fixedRate, handler, tuple(args), kwds or {}, executor if not executor is None else self.__executor)
+        with self.__condition:
+            if self.__terminated:
+                raise ValueError("TimerWheel is already shut down")
+            self.__active += 1
+            self.__pending.append(handle)
+            if self.__active == 1:
+                self.__condition.notify() # wake the idle wheel thread
+        return handle
+    
+    def _reschedule(self, handle):
+        """
+        (internal) Enqueues a fixed-delay timer again after its handler is done
+        """
+        self.__pending.append(handle)
+    
+    def _cancel(self, handle):
+        """
+        (internal) Cancels a timer, the timer is removed from its bucket lazily by the wheel thread
+        """
+        with self.__condition:
+            if handle.cancelled or handle.deadline is None:
+                return False
+            handle._markCancelled()
+            self.__active -= 1
+            return True
+    
+    def __done(self, handle):
+        """
+        (internal private) Marks an one-shot timer done
+        """
+        with self.__condition:
+            if not handle.cancelled:
+                handle.deadline = None
+                self.__active -= 1
+    
+    def __run(self):
+        """
+        (internal private) Body of the wheel thread
+        """
+        wheel = self.__wheel
+        wheelSize = len(wheel)
+        tickDuration = self.__tickDuration
+        startTime = monotonic()
+        tick = 0
+        while True:
+            with self.__condition:
+                while not self.__terminated and self.__active == 0:
+                    # idle, the wheel is restarted by the next timer
+                    self.__condition.wait()
+                    startTime = monotonic()
+                    tick = 0
+                if self.__terminated:
+                    return
+            
+            tickDeadline = startTime + (tick + 1) * tickDuration
+            now = monotonic()
+            if now < tickDeadline:
+                with self.__condition:
+                    if not self.__terminated:
+                        self.__condition.wait(tickDeadline - now)
+                continue # re-check the deadline, the wait may be woken by new timers
+            
+            while self.__pending:
+                handle = self.__pending.popleft()
+                self.__place(handle, startTime, tick)
+            
+            bucket = wheel[tick % wheelSize]
+            if bucket:
+                remains = []
+                rescheduled = []
+                for handle in bucket:
+                    if handle.cancelled:
+                        continue
+                    if handle.rounds > 0:
+                        handle.rounds -= 1
+                        remains.append(handle)
+                        continue
+                    handle._expire(now)
+                    if not handle.periodic:
+                        self.__done(handle)
+                    elif handle.fixedRate and not handle.cancelled:
+                        handle.deadline += handle.period
+                        if handle.deadline <= now:
+                            # the wheel thread is late, skips expirations instead of firing a burst
+                            skipped = int(math.floor((now - handle.deadline) / handle.period)) + 1
+                            handle.deadline += skipped * handle.period
+                            handle.missed += skipped
+                        rescheduled.append(handle)
+                wheel[tick % wheelSize] = remains
+                for handle in rescheduled:
+                    self.__place(handle, startTime, tick + 1)
+            tick += 1
+    
+    def __place(self, handle, startTime, tick):
+        """
+        (internal private) Puts a timer into the bucket of its deadline, the timer expires after the end of the tick which contains the deadline
+        
+        @param tick: the tick which is processed next
+        """
+        ticks = max(tick, int((handle.deadline - startTime) / self.__tickDuration))
+        handle.rounds = (ticks - tick) // len(self.__wheel)
+        self.__wheel[ticks % len(self.__wheel)].append(handle)
+
 class ContinuousTimer(StepwiseTask):
+    """
+    Periodic timer which occupies a thread while running.
+    Ticks are scheduled at absolute deadlines(start + n * interval) of the monotonic clock, so errors are not accumulated and
+    system clock updates do not affect the timer. Ticks which are missed by overrunning handlers are treated by missedTickPolicy.
+    The handler is invoked in the form of (handler(timer, *args, **kwds)).
+    """
     
     def __init__(self, interval, handler, *args, **kwds):
         def _gen():
+            deadline = monotonic()
             while True:
-                begin = time.time()
+                now = monotonic()
+                while now < deadline:
+                    time.sleep(deadline - now)
+                    now = monotonic()
+                self.__lateness = max(self.__lateness, now - deadline)
                 if self.__enabled:
                     self.__handler(self, *args, **kwds)
+                self.__ticks += 1
                 yield True
-                await = self.__interval - (time.time() - begin)
-                if await > 0:
-                    time.sleep(await)
+                deadline += self.__interval
+                now = monotonic()
+                if now > deadline:
+                    self.__overrun(now, deadline)
+                    deadline = self.__catchUp(now, deadline)
         super(ContinuousTimer, self).__init__(_gen)
-        self.__interval = interval
-        self.__handler = handler
+        self.interval = interval
+        self.handler = handler
         self.__enabled = True
+        self.__missedTickPolicy = MissedTickPolicy.SKIP
+        self.__ticks = 0
+        self.__overruns = 0
+        self.__missed = 0
+        self.__maxOverrun = 0.0
+        self.__lateness = 0.0
+    
+    def __overrun(self, now, deadline):
+        """
+        (internal private) Records an overrun, the handler finished after the next deadline
+        """
+        self.__overruns += 1
+        self.__maxOverrun = max(self.__maxOverrun, now - deadline)
+    
+    def __catchUp(self, now, deadline):
+        """
+        (internal private) Decides the next deadline after an overrun by missedTickPolicy
+        
+        @param deadline: the deadline which is already passed
+        @return: the next deadline
+        """
+        behind = int((now - deadline) / self.__interval) + 1 # number of passed deadlines
+        if self.__missedTickPolicy == MissedTickPolicy.SKIP:
+            self.__missed += behind
+            return deadline + behind * self.__interval
+        elif self.__missedTickPolicy == MissedTickPolicy.COALESCE:
+            self.__missed += behind - 1
+            return deadline + (behind - 1) * self.__interval
+        else:
+            return deadline
     
     @property
     def enabled(self):
         return self.__enabled
     
     @enabled.setter
-    def __set_enabled(self, val):
+    def enabled(self, val):
         self.__enabled = bool(val)
     
     @property
@@ -42,7 +430,7 @@ class ContinuousTimer(StepwiseTask):
         return self.__interval
     
     @interval.setter
-    def __set_interval(self, value):
+    def interval(self, value):
         if not hasattr(value, "__float__"):
             raise ValueError("%s is not a float-like object" % value)
         value = float(value)
@@ -59,6 +447,34 @@ class ContinuousTimer(StepwiseTask):
         if not callable(handler):
             raise ValueError("%s is not a callable object" % handler)
         self.__handler = handler
+    
+    @property
+    def missedTickPolicy(self):
+        """
+        MissedTickPolicy which is applied when the handler overruns the next deadline, MissedTickPolicy.SKIP by default
+        """
+        return self.__missedTickPolicy
+    
+    @missedTickPolicy.setter
+    def missedTickPolicy(self, policy):
+        if not isinstance(policy, MissedTickPolicy):
+            raise ValueError("%s is not a MissedTickPolicy" % policy)
+        self.__missedTickPolicy = policy
+    
+    @property
+    def statistics(self):
+        """
+        Overrun statistics in the form of a dict.
+        ticks: number of performed ticks, overruns: number of ticks which finished after the next deadline,
+        missed: number of ticks which are not performed, maxOverrun: maximum overrun in seconds, maxLateness: maximum delay of a tick from its deadline in seconds
+        """
+        return {
+                "ticks": self.__ticks,
+                "overruns": self.__overruns,
+                "missed": self.__missed,
+                "maxOverrun": self.__maxOverrun,
+                "maxLateness": self.__lateness,
+                }
 
 # class PeriodicalTimer(Task):
 #     pass
@@ -70,4 +486,38 @@ if __name__ == "__main__":
     timer1 = ContinuousTimer(0.1, printFunc, "timer1")
     ex.submit(timer1)
     time.sleep(3)
-    
\ No newline at end of file
+    timer1.cancel()
+    
+    for policy in (MissedTickPolicy.SKIP, MissedTickPolicy.COALESCE, MissedTickPolicy.BURST):
+        timer2 = ContinuousTimer(0.01, lambda timer: time.sleep(0.025 if timer.statistics["ticks"] % 10 == 0 else 0))
+        timer2.missedTickPolicy = policy
+        ex.submit(timer2)
+        time.sleep(1)
+        timer2.cancel()
+        print policy, timer2.statistics
+    
+    wheel = TimerWheel()
+    wheel.schedule(0.5, printFunc, ("one-shot",))
+    wheel.scheduleAtFixedRate(0, 0.25, printFunc, ("fixed-rate",))
+    wheel.scheduleWithFixedDelay(0, 0.25, lambda timer: time.sleep(0.1) or printFunc(timer, "fixed-delay"), executor = ex)
+    time.sleep(2)
+    
+    # a saturated bounded Executor rejects the expirations, but the wheel keeps running
+    from pyth2.concurrent.Concurrent import RejectionPolicy, RejectedExecutionError
+    release = threading.Event()
+    bounded = Executor(True, poolMaxSize = 1, queueCapacity = 1, rejectionPolicy = RejectionPolicy.RAISE)
+    try:
+        while True:
+            bounded.submit(release.wait)
+            time.sleep(0.1)
+    except RejectedExecutionError:
+        sys.exc_clear()
+    rejected = wheel.scheduleWithFixedDelay(0, 0.05, printFunc, ("rejected",), executor = bounded)
+    ticks = []
+    wheel.scheduleAtFixedRate(0, 0.01, lambda timer: ticks.append(timer))
+    time.sleep(0.5)
+    print "while saturated:", rejected, len(ticks) > 0
+    release.set()
+    time.sleep(0.5)
+    print "after released:", rejected
+    wheel.shutdown()
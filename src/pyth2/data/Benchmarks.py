@@ -0,0 +1,95 @@
+# encoding: utf-8
+'''
+Created on 2016/03/16
+
+@author: _
+
+Benchmarks for pyth2.data.
+Run as "python -m pyth2.data.Benchmarks [benchmark name ...]", all benchmarks are run if no name is given.
+'''
+import itertools
+import random
+import sys
+import time
+
+from pyth2.data.RowConverter import RowConverter
+from pyth2.data.TypeEstimator import EstimationContext, RegexDatetimeEstimator, SInt32Estimator, NotNaNFloatEstimator, StringEstimator
+
+
+def _estimators():
+    return (
+            RegexDatetimeEstimator.parameterizedInitializer(nullable = False),
+            SInt32Estimator(False),
+            NotNaNFloatEstimator(False),
+            StringEstimator(False))
+
+def _syntheticColumns(distinctCount = 100000):
+    """
+    Returns a list of pairs of (column name, distinct values), columns are synthesized by cycling the values
+    """
+    rnd = random.Random(0)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon"]
+    return [
+            ("int", [str(rnd.randint(-2 ** 31, 2 ** 31 - 1)) for _ in xrange(distinctCount)]),
+            ("float", ["%.3f" % rnd.uniform(-1e6, 1e6) for _ in xrange(distinctCount)]),
+            ("datetime", ["2016%02d%02d%02d%02d%02d" % (rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59)) for _ in xrange(distinctCount)]),
+            ("text", [" ".join(rnd.choice(words) for _ in xrange(3)) for _ in xrange(distinctCount)]),
+            ]
+
+def benchmarkUpdateMany(rowCount = 10000000):
+    """
+    Compares the per-cell loop(EstimationContext.update) with the chunked batch API(EstimationContext.updateMany) on synthetic columns of rowCount rows.
+    """
+    for name, distinct in _syntheticColumns():
+        results = []
+        for mode in ("update", "updateMany"):
+            context = EstimationContext(_estimators())
+            values = itertools.islice(itertools.cycle(distinct), rowCount)
+            begin = time.time()
+            if mode == "update":
+                update = context.update
+                for value in values:
+                    update(value)
+            else:
+                context.updateMany(values)
+            elapsed = time.time() - begin
+            results.append(context.feasible)
+            print "%-10s %-12s %8.3f sec %12.1f cells/sec  feasible %s" % (name, mode, elapsed, rowCount / elapsed, context.feasible)
+        if str(results[0]) != str(results[1]):
+            raise AssertionError("Results differ: %s" % results)
+
+def benchmarkRowConverter(rowCount = 1000000):
+    """
+    Compares per-cell conversion by ValueEstimator.parser(validation and conversion) with the compiled RowConverter on rowCount synthetic rows.
+    """
+    columns = _syntheticColumns()
+    estimators = []
+    for _, distinct in columns:
+        context = EstimationContext(_estimators())
+        context.updateMany(distinct)
+        estimators.append(context.feasible)
+    rows = zip(*[distinct for _, distinct in columns])
+    rows = [rows[i % len(rows)] for i in xrange(rowCount)]
+    results = []
+    for mode in ("parser", "RowConverter"):
+        begin = time.time()
+        if mode == "parser":
+            parsers = [e.parser for e in estimators]
+            converted = [tuple(parser(value) for parser, value in itertools.izip(parsers, row)) for row in rows]
+        else:
+            converted = RowConverter(estimators).convertRows(rows)
+        elapsed = time.time() - begin
+        results.append(converted)
+        print "%-12s %8.3f sec %12.1f rows/sec" % (mode, elapsed, rowCount / elapsed)
+    if results[0] != results[1]:
+        raise AssertionError("Results differ")
+
+BENCHMARKS = {
+              "rowConverter": benchmarkRowConverter,
+              "updateMany": benchmarkUpdateMany,
+              }
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or sorted(BENCHMARKS):
+        print "== %s" % name
+        BENCHMARKS[name]()
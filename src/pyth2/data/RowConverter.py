@@ -0,0 +1,72 @@
+# encoding: utf-8
+'''
+Created on 2016/03/19
+
+@author: _
+
+Compiled conversion of rows by a schema of ValueEstimators.
+The converting function is generated as Python source for each schema and compiled once, so a row(or a batch of rows) is converted in one frame
+by the converter of each column(ValueEstimator.converter) without validation, i.e. every cell is parsed only once.
+'''
+from pyth2.data.TypeEstimator import ValueEstimator, StringEstimator
+
+
+class RowConverter(object):
+    """
+    Converts rows of strings into tuples of values by the feasible estimators of the columns.
+    Empty strings of nullable columns(except string columns) are converted into None.
+    Rows must have the same number of fields as the estimators, and every field must be accepted by the estimator of the column.
+    """
+    
+    def __init__(self, estimators):
+        """
+        Initializer
+        
+        @param estimators: a sequence of ValueEstimators of the columns(e.g. EstimationContext.feasible of each column)
+        """
+        estimators = list(estimators)
+        for i, e in enumerate(estimators):
+            if not isinstance(e, ValueEstimator):
+                raise ValueError("Column %d does not have an estimator: %s" % (i, e))
+        self.__estimators = tuple(estimators)
+        namespace = {}
+        expressions = []
+        for i, e in enumerate(estimators):
+            converter = e.converter
+            if converter is str:
+                expressions.append("v%d" % i) # csv fields are already str
+                continue
+            namespace["c%d" % i] = converter
+            if e.nullable and not isinstance(e, StringEstimator):
+                expressions.append("c%d(v%d) if v%d else None" % (i, i, i))
+            else:
+                expressions.append("c%d(v%d)" % (i, i))
+        variables = "[%s]" % ", ".join("v%d" % i for i in xrange(len(estimators))) # list form also unpacks a row of no columns
+        values = "(%s)" % "".join("%s, " % expression for expression in expressions)
+        self.source = "\n".join((
+                                 "def convertRow(row):",
+                                 "    %s = row" % variables,
+                                 "    return %s" % values,
+                                 "def convertRows(rows):",
+                                 "    return [%s for %s in rows]" % (values, variables),
+                                 ""))
+        exec compile(self.source, "<RowConverter>", "exec") in namespace
+        self.convertRow = namespace["convertRow"]
+        self.convertRows = namespace["convertRows"]
+    
+    @property
+    def estimators(self):
+        return self.__estimators
+    
+    def __call__(self, row):
+        return self.convertRow(row)
+    
+    def __str__(self):
+        return "%s[%s]" % (self.__class__.__name__, ", ".join(str(e) for e in self.__estimators))
+
+if __name__ == "__main__":
+    from pyth2.data.TypeEstimator import RegexDatetimeEstimator, SInt32Estimator, NotNaNFloatEstimator
+    converter = RowConverter((RegexDatetimeEstimator.parameterizedInitializer(nullable = False), SInt32Estimator(True), NotNaNFloatEstimator(False), StringEstimator(True)))
+    print converter.source
+    print converter(["20160404010102", "", "3.5", "abc"])
+    print converter.convertRows([["20160404010102", "12", "3.5", "abc"], ["20160405010102", "-1", "inf", ""]])
@@ -5,6 +5,8 @@ Created on 2016/01/31
 @author: oreyou
 '''
 from datetime import datetime
+import codecs
+import itertools
 import math
 import re
 import cStringIO
@@ -12,6 +14,11 @@ import csv
 import types
 
 
+DEFAULT_UPDATE_CHUNK_SIZE = 4096 # EstimationContext.updateMany が一度に検証する値の数
+
+_SEPARABLE_ENCODINGS = frozenset(("ascii", "utf-8", "iso8859-1", "euc_jp", "shift_jis", "cp932")) # 改行で連結した文字列を一括で変換しても、各値の変換の成否が変わらない文字エンコード
+
+
 class ValueEstimator(object):
     '''
     文字列を受け入れられるか検証するもの
@@ -48,6 +55,43 @@ class ValueEstimator(object):
         '''
         raise ValueError("Cannot accept")
     
+    def checkMany(self, strValues):
+        '''
+        文字列のリストをまとめて検証する.
+        結果はすべての文字列に check() を行った場合と同じになる.
+        このメソッドをオーバーライドしてはならない
+        
+        @param strValues: 対象の文字列のリスト
+        @return: すべての文字列を受け入れられる場合は True
+        '''
+        if not strValues:
+            return True
+        if not self.nullable and (None in strValues or "" in strValues):
+            return False
+        try:
+            return bool(self._checkManyImpl(strValues))
+        except:
+            return False
+    
+    def _checkManyImpl(self, strValues):
+        '''
+        文字列のリストをまとめて検証する.
+        既定の実装は _checkImpl() を C のループ(itertools.imap)で適用する. 一括変換などで速く検証できるサブクラスはこのメソッドをオーバーライドする
+        
+        @param strValues: 対象の文字列のリスト(self.nullableが Falseと等価な場合は Noneおよび空文字列を含まない)
+        @return: すべての文字列を受け入れられる場合は Trueと等価な値
+        @raise: いずれかの文字列を受け入れられない場合
+        '''
+        return all(itertools.imap(self._checkImpl, strValues))
+    
+    @property
+    def acceptsAll(self):
+        '''
+        この検証するものがあらゆる文字列を受け入れる場合は True.
+        受け入れ状態が変化しないことが分かるので、これ以上の検証を省略できる
+        '''
+        return False
+    
     @property
     def parser(self):
         """
@@ -62,6 +106,17 @@ class ValueEstimator(object):
         """
         raise NotImplemented
     
+    @property
+    def converter(self):
+        """
+        この検証するものが受理した(空でない)文字列を受け取って値を返す関数を得る.
+        parserと異なり検証を行わないので、文字列の解析は1回で済む. 受理されない文字列を与えた場合の結果は定めない.
+        既定の実装は parserを返す. 速く変換できるサブクラスはこのプロパティをオーバーライドする
+        
+        @return: 文字列を受け取って値を返す関数
+        """
+        return self.parser
+    
     @property
     def presenter(self):
         """
@@ -107,6 +162,14 @@ class EstimationContext(object):
     @property
     def feasible(self):
         return self.__estimators[0] if self.__estimators else None
+    
+    @property
+    def settled(self):
+        '''
+        これ以上検証しても feasibleが変化しない場合は True.
+        受け入れ可能なものが残っていないか、feasibleがあらゆる文字列を受け入れる場合
+        '''
+        return not self.__estimators or self.__estimators[0].acceptsAll
             
     def update(self, strValue):
         '''
@@ -114,12 +177,33 @@ class EstimationContext(object):
         
         @param strValue: 検証する文字列
         '''
-        for est in self.__estimators:
-            try:
-                if not est.check(strValue):
-                    self.__estimators.remove(est)
-            except:
-                self.__estimators.remove(est)
+        self.__estimators = [est for est in self.__estimators if _checkSafely(est, strValue)]
+    
+    def updateMany(self, strValues, chunkSize = DEFAULT_UPDATE_CHUNK_SIZE):
+        '''
+        この EstimationContextの持つ ValueEstimatorの集合に対して、文字列の列を chunkSize個ずつまとめて検証し、受け入れ状態を更新する.
+        結果はすべての文字列に update() を行った場合と同じになる
+        
+        @param strValues: 検証する文字列の列挙可能なもの
+        @param chunkSize: 一度に検証する文字列の数
+        '''
+        if int(chunkSize) <= 0:
+            raise ValueError("Chunk size must be more than 0")
+        iterator = iter(strValues)
+        while self.__estimators:
+            chunk = list(itertools.islice(iterator, chunkSize))
+            if not chunk:
+                return
+            self.__estimators = [est for est in self.__estimators if est.checkMany(chunk)]
+
+def _checkSafely(estimator, strValue):
+    '''
+    (internal) 例外を受け入れられないものとして文字列を検証する
+    '''
+    try:
+        return estimator.check(strValue)
+    except:
+        return False
 
 class StringEstimator(ValueEstimator):
     '''
@@ -132,10 +216,21 @@ class StringEstimator(ValueEstimator):
     def _checkImpl(self, strValue):
         return True
     
+    def _checkManyImpl(self, strValues):
+        return True
+    
+    @property
+    def acceptsAll(self):
+        return self.nullable
+    
     @property
     def parser(self):
         return lambda s: str(s) if self.check(s) else None
     
+    @property
+    def converter(self):
+        return str
+    
     @property
     def presenter(self):
         return lambda v: None if v is None else str(v)
@@ -159,10 +254,20 @@ class UnicodeEstimator(ValueEstimator):
         unicode(strValue, self.strEncode)
         return True
     
+    def _checkManyImpl(self, strValues):
+        if codecs.lookup(self.strEncode).name in _SEPARABLE_ENCODINGS:
+            unicode("\n".join(strValues), self.strEncode) # 改行は多バイト文字の一部にならないので、連結しても各値の境界で変換に失敗する
+            return True
+        return super(UnicodeEstimator, self)._checkManyImpl(strValues)
+    
     @property
     def parser(self):
         return lambda s: unicode(s, self.strEncode) if self.check(s) else None
     
+    @property
+    def converter(self):
+        return lambda s: unicode(s, self.strEncode)
+    
     @property
     def presenter(self):
         return lambda v: str(v).decode(self.strEncode)
@@ -189,6 +294,10 @@ class RegexEstimator(ValueEstimator):
     def parser(self):
         return lambda s: self.pattern.match(s) if self.check(s) else None
     
+    @property
+    def converter(self):
+        return self.pattern.match
+    
     @property
     def presenter(self):
         return lambda v: str(v)
@@ -219,10 +328,18 @@ class RangedIntEstimator(ValueEstimator):
     def _checkImpl(self, strValue):
         return self.minInt <= int(strValue) <= self.maxInt
     
+    def _checkManyImpl(self, strValues):
+        ints = map(int, strValues)
+        return self.minInt <= min(ints) and max(ints) <= self.maxInt
+    
     @property
     def parser(self):
         return lambda s: int(s) if self.check(s) else None
     
+    @property
+    def converter(self):
+        return int
+    
     @property
     def presenter(self):
         return lambda v: str(v) if isinstance(v, types.IntType) else None
@@ -299,10 +416,21 @@ class FloatClassEstimator(ValueEstimator):
         else:
             return self.minValue <= float(strValue) <= self.maxValue
     
+    def _checkManyImpl(self, strValues):
+        floats = map(float, strValues) # "nan", "inf" などの特別な文字列も floatへ変換できるので、変換の失敗は _checkImpl() の失敗と一致する
+        total = sum(floats)
+        if math.isnan(total) or math.isinf(total):
+            return super(FloatClassEstimator, self)._checkManyImpl(strValues) # NaNまたは無限大(まれ)を含むので、1つずつ検証する
+        return self.minValue <= min(floats) and max(floats) <= self.maxValue
+    
     @property
     def parser(self):
         return lambda s: float(s) if self.check(s) else None
     
+    @property
+    def converter(self):
+        return float
+    
     @property
     def presenter(self):
         return lambda v: str(v) if isinstance(v, types.FloatType) else None
@@ -323,6 +451,10 @@ class DatetimeClassEstimator(ValueEstimator):
     def parser(self):
         return lambda s: datetime.strftime(s, self.strpFormat) if self.check(s) else None
     
+    @property
+    def converter(self):
+        return lambda s: datetime.strptime(s, self.strpFormat)
+    
     @property
     def presenter(self):
         return lambda v: v.strptime(self.strpFormat) if isinstance(v, datetime) else None
@@ -354,6 +486,17 @@ class RegexDatetimeEstimator(ValueEstimator):
             return datetime(**{k: int(md[k]) for k in RegexDatetimeEstimator.regexDatetimeParts if k in md})
         return _parser
     
+    @property
+    def converter(self):
+        parts = [k for k in RegexDatetimeEstimator.regexDatetimeParts if k in self._pattern.groupindex]
+        match = self._pattern.match
+        if len(parts) >= 3 and parts == RegexDatetimeEstimator.regexDatetimeParts[:len(parts)] and not "tzinfo" in parts:
+            return lambda s: datetime(*map(int, match(s).group(*parts))) # datetimeの位置引数の順序に並んでいる場合
+        def _converter(s):
+            md = match(s).groupdict()
+            return datetime(**{k: int(md[k]) for k in parts})
+        return _converter
+    
 #     @property
 #     def presenter(self):
 #         raise NotImplemented
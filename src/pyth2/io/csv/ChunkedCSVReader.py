@@ -0,0 +1,130 @@
+# encoding: utf-8
+'''
+Created on 2016/03/18
+
+@author: _
+
+Streaming CSV reader which reads a file in fixed-size chunks.
+Each chunk is cut at the last row boundary(a newline outside quoted fields) and parsed by csv.reader in C, the rest is carried over to the next chunk,
+so memory use is bounded by the chunk size(plus the longest row) regardless of the file size.
+'''
+import cStringIO
+import csv
+import os
+
+
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024 # bytes, size of a chunk which is read at once
+
+def readerArgs(delimiter = ",", quoteChar = '"'):
+    """
+    Returns keyword arguments of csv.reader
+    
+    @param delimiter: a delimiter character
+    @param quoteChar: a quote character, or None if fields are never quoted
+    """
+    return {"delimiter": delimiter, "quotechar": quoteChar or '"', "quoting": csv.QUOTE_MINIMAL if quoteChar else csv.QUOTE_NONE}
+
+class ChunkedCSVReader(object):
+    """
+    Iterable of rows(lists of strings) of a CSV file or a byte range of it.
+    Rows are read chunk by chunk, quoted newlines are kept in fields.
+    """
+    
+    def __init__(self, path, start = 0, end = None, bufferSize = DEFAULT_BUFFER_SIZE, delimiter = ",", quoteChar = '"'):
+        """
+        Initializer
+        
+        @param path: a path of the CSV file
+        @param start: a bytes offset of a row boundary where reading begins
+        @param end: a bytes offset of a row boundary where reading ends, or None for the end of the file
+        @param bufferSize: bytes of a chunk
+        @param delimiter: a delimiter character
+        @param quoteChar: a quote character, or None if fields are never quoted
+        """
+        if int(bufferSize) <= 0:
+            raise ValueError("Buffer size must be more than 0")
+        size = os.path.getsize(path)
+        end = size if end is None else min(int(end), size)
+        if not 0 <= start <= end:
+            raise ValueError("Invalid range: %d - %d" % (start, end))
+        self.path = path
+        self.start = int(start)
+        self.end = end
+        self.bufferSize = int(bufferSize)
+        self.delimiter = delimiter
+        self.quoteChar = quoteChar
+        self.__bytesRead = 0
+    
+    @property
+    def bytesRead(self):
+        """
+        Bytes which are read so far
+        """
+        return self.__bytesRead
+    
+    def chunks(self):
+        """
+        Generates chunks of the file, every chunk consists of complete rows
+        
+        @return: generator of strings
+        """
+        carry = ""
+        remaining = self.end - self.start
+        with open(self.path, "rb") as f:
+            f.seek(self.start)
+            while remaining > 0:
+                block = f.read(min(self.bufferSize, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                self.__bytesRead += len(block)
+                block = carry + block if carry else block
+                boundary = self.__lastBoundary(block) if remaining > 0 else len(block)
+                if boundary <= 0:
+                    carry = block # a row is longer than the chunk
+                    continue
+                carry = block[boundary:]
+                yield block[:boundary] if carry else block
+        if carry:
+            yield carry
+    
+    def __lastBoundary(self, chunk):
+        """
+        (internal private) Returns the offset just after the last newline outside quoted fields, or 0 if not found.
+        The chunk begins at a row boundary, so a newline is outside quoted fields if the number of quote characters before it is even.
+        """
+        newline = chunk.rfind("\n")
+        if self.quoteChar is None or newline < 0:
+            return newline + 1
+        quotes = chunk.count(self.quoteChar, 0, newline)
+        while newline >= 0 and quotes % 2 == 1:
+            previous = chunk.rfind("\n", 0, newline)
+            quotes -= chunk.count(self.quoteChar, previous + 1, newline)
+            newline = previous
+        return newline + 1
+    
+    def batches(self):
+        """
+        Generates rows chunk by chunk
+        
+        @return: generator of lists of rows
+        """
+        args = readerArgs(self.delimiter, self.quoteChar)
+        for chunk in self.chunks():
+            yield list(csv.reader(cStringIO.StringIO(chunk), **args))
+    
+    def __iter__(self):
+        args = readerArgs(self.delimiter, self.quoteChar)
+        for chunk in self.chunks():
+            for row in csv.reader(cStringIO.StringIO(chunk), **args):
+                yield row
+
+if __name__ == "__main__":
+    import sys
+    import time
+    for path in sys.argv[1:]:
+        begin = time.time()
+        reader = ChunkedCSVReader(path)
+        rows = sum(len(batch) for batch in reader.batches())
+        elapsed = time.time() - begin
+        print "%s: %d rows, %.1f MB/s" % (path, rows, reader.bytesRead / elapsed / 1e6 if elapsed else 0.0)
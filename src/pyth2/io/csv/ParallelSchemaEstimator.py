@@ -0,0 +1,412 @@
+# encoding: utf-8
+'''
+Created on 2016/03/17
+
+@author: _
+
+Parallel schema estimation of a CSV file.
+1) the file is sharded by byte ranges which are aligned to row boundaries(quoted newlines are respected)
+2) each shard is estimated column by column in worker processes(EstimationContext.updateMany)
+3) surviving estimators of the shards are merged by intersection, so the result is identical to a serial run regardless of sharding
+With early termination(opt-in), a column is no longer checked once its feasible estimator accepts anything(EstimationContext.settled), and a shard is no longer read once all columns are settled.
+For previews, rows can be sampled(HeadSampling, ReservoirSampling, StratifiedSampling) instead of scanning the whole file.
+'''
+import collections
+import csv
+import itertools
+import multiprocessing
+import os
+import random
+
+from pyth2.concurrent.ProcessExecutor import ProcessExecutor
+from pyth2.data.RowConverter import RowConverter
+from pyth2.data.TypeEstimator import EstimationContext, RegexDatetimeEstimator, SInt32Estimator, NotNaNFloatEstimator, StringEstimator, \
+    DEFAULT_UPDATE_CHUNK_SIZE
+from pyth2.io.csv.ChunkedCSVReader import ChunkedCSVReader, readerArgs, DEFAULT_BUFFER_SIZE
+from pyth2.io.csv.CSVSchema import BaseSchema
+
+
+DEFAULT_SHARD_SIZE = 64 * 1024 * 1024 # bytes, approximate size of a shard
+
+SCAN_BLOCK_SIZE = 1024 * 1024 # bytes, size of a block which is read at once to align shard boundaries
+
+DEFAULT_SAMPLE_ROWS = 10000 # number of rows of a sample
+
+DEFAULT_STRATA = 32 # number of byte ranges which StratifiedSampling picks rows from
+
+DEFAULT_CONFIDENCE_LEVEL = 0.95 # confidence level of EstimatedSchema.rejectionBounds
+
+def defaultEstimators():
+    """
+    Returns estimators which are tried in order(the first survivor is the feasible one), the last one accepts everything
+    """
+    return (
+            RegexDatetimeEstimator.parameterizedInitializer(nullable = False),
+            SInt32Estimator(False),
+            NotNaNFloatEstimator(False),
+            StringEstimator(True))
+
+class EstimatedSchema(BaseSchema):
+    """
+    Schema of a CSV file which is estimated by ValueEstimators.
+    """
+    
+    def __init__(self, names, contexts, checkedCounts = None, exhaustive = True, bytesRead = None):
+        """
+        Initializer
+        
+        @param names: a list of column names(the header row), or None
+        @param contexts: a list of EstimationContext objects of the columns
+        @param checkedCounts: a list of numbers of values which are checked for the columns, or None if unknown
+        @param exhaustive: True if all rows of the file are estimated, False if the contexts are estimated from a sample
+        @param bytesRead: bytes of the file which are read for the estimation(less than the file size with early termination), or None if unknown
+        """
+        self.names = names
+        self.contexts = contexts
+        self.checkedCounts = checkedCounts if not checkedCounts is None else [0] * len(contexts)
+        self.exhaustive = exhaustive
+        self.bytesRead = bytesRead
+    
+    @property
+    def feasibles(self):
+        """
+        A list of feasible ValueEstimators of the columns(None if no estimators accept the column)
+        """
+        return [context.feasible for context in self.contexts]
+    
+    def converter(self):
+        """
+        Returns a compiled RowConverter of the feasible estimators, which converts rows of the file into typed tuples
+        
+        @raise ValueError: a column does not have a feasible estimator
+        """
+        return RowConverter(self.feasibles)
+    
+    def rejectionBounds(self, level = DEFAULT_CONFIDENCE_LEVEL):
+        """
+        Returns upper confidence bounds of the ratio of values which the feasible estimator would reject in the whole column.
+        A bound is 0 if the column is certain(estimated exhaustively, or settled), otherwise it is 1 - (1 - level) ** (1 / n) for n checked values without rejection
+        (about 3 / n at 95%), which assumes the sample represents the column.
+        
+        @param level: a confidence level in (0, 1)
+        @return: a list of ratios in [0, 1] of the columns
+        """
+        if not 0 < level < 1:
+            raise ValueError("Confidence level must be in (0, 1): %f" % level)
+        return [0.0 if self.exhaustive or context.settled else 1.0 - (1.0 - level) ** (1.0 / count) if count else 1.0
+                for context, count in itertools.izip(self.contexts, self.checkedCounts)]
+    
+    def __str__(self):
+        names = list(self.names or ()) + [str(i) for i in xrange(len(self.names or ()), len(self.contexts))]
+        if self.exhaustive:
+            return "\n".join("%s: %s" % (name, feasible) for name, feasible in itertools.izip(names, self.feasibles))
+        return "\n".join("%s: %s (%d values, up to %.3f%% rejected at %d%% confidence)" % (name, feasible, count, bound * 100, DEFAULT_CONFIDENCE_LEVEL * 100)
+                         for name, feasible, count, bound in itertools.izip(names, self.feasibles, self.checkedCounts, self.rejectionBounds()))
+
+class Sampling(object):
+    """
+    Strategy which picks rows of a CSV file to estimate instead of the whole file
+    """
+    
+    def __init__(self, rows = DEFAULT_SAMPLE_ROWS):
+        """
+        Initializer
+        
+        @param rows: maximum number of sampled rows
+        """
+        if int(rows) <= 0:
+            raise ValueError("Rows must be more than 0")
+        self.rows = int(rows)
+    
+    def sample(self, path, hasHeader, readerArgs):
+        """
+        Picks rows of the file
+        
+        @param path: a path of the CSV file
+        @param hasHeader: the first row is the column names if True
+        @param readerArgs: a dict of keyword arguments of csv.reader
+        @return: a tuple of (header row or None, a list of sampled rows, True if the sample is all rows of the file)
+        """
+        raise NotImplementedError()
+    
+    def __str__(self):
+        return "%s(%d)" % (self.__class__.__name__, self.rows)
+
+class HeadSampling(Sampling):
+    """
+    Samples the first rows of the file, the cost does not depend on the file size.
+    """
+    
+    def sample(self, path, hasHeader, readerArgs):
+        with open(path, "rb") as f:
+            reader = csv.reader(f, **readerArgs)
+            header = next(reader, None) if hasHeader else None
+            rows = list(itertools.islice(reader, self.rows + 1))
+        return header, rows[:self.rows], len(rows) <= self.rows
+
+class ReservoirSampling(Sampling):
+    """
+    Samples rows uniformly at random(reservoir sampling), the whole file is read once.
+    """
+    
+    def __init__(self, rows = DEFAULT_SAMPLE_ROWS, seed = None):
+        """
+        Initializer
+        
+        @param rows: maximum number of sampled rows
+        @param seed: a seed of the random numbers, or None
+        """
+        super(ReservoirSampling, self).__init__(rows)
+        self.seed = seed
+    
+    def sample(self, path, hasHeader, readerArgs):
+        randint = random.Random(self.seed).randint
+        with open(path, "rb") as f:
+            reader = csv.reader(f, **readerArgs)
+            header = next(reader, None) if hasHeader else None
+            reservoir = list(itertools.islice(reader, self.rows))
+            count = len(reservoir)
+            for count, row in enumerate(reader, count + 1):
+                index = randint(0, count - 1)
+                if index < self.rows:
+                    reservoir[index] = row
+        return header, reservoir, count <= self.rows
+
+class StratifiedSampling(Sampling):
+    """
+    Samples runs of rows from evenly spaced byte ranges.
+    The ranges are aligned to row boundaries by shardRanges, so the file is scanned once for quote characters(in C, str.count) but only the sampled rows are parsed.
+    """
+    
+    def __init__(self, rows = DEFAULT_SAMPLE_ROWS, strata = DEFAULT_STRATA):
+        """
+        Initializer
+        
+        @param rows: maximum number of sampled rows
+        @param strata: number of byte ranges
+        """
+        super(StratifiedSampling, self).__init__(rows)
+        if int(strata) <= 0:
+            raise ValueError("Strata must be more than 0")
+        self.strata = int(strata)
+    
+    def sample(self, path, hasHeader, readerArgs):
+        strata = min(self.strata, self.rows)
+        runLength = self.rows // strata
+        quoteChar = readerArgs.get("quotechar") if readerArgs.get("quoting") != csv.QUOTE_NONE else None
+        header = None
+        rows = []
+        exhaustive = True
+        with open(path, "rb") as f:
+            for start, end in shardRanges(path, strata, quoteChar):
+                reader = csv.reader(_rangeLines(f, start, end), **readerArgs)
+                if start == 0 and hasHeader:
+                    header = next(reader, None)
+                run = list(itertools.islice(reader, runLength + 1))
+                if len(run) > runLength:
+                    exhaustive = False
+                    del run[runLength:]
+                rows.extend(run)
+        return header, rows, exhaustive
+
+def shardRanges(path, shardCount, quoteChar = '"'):
+    """
+    Splits a file into byte ranges of almost equal sizes, every range begins at a row boundary.
+    A newline is a row boundary if the number of quote characters before it is even, so the whole file is scanned once(in C, str.count) if quoteChar is given.
+    
+    @param path: a path of the file
+    @param shardCount: maximum number of ranges
+    @param quoteChar: a quote character, or None if fields never contain newlines(boundaries are found by seeking)
+    @return: a list of pairs of (start, end) bytes offset
+    """
+    if int(shardCount) <= 0:
+        raise ValueError("Shard count must be more than 0")
+    size = os.path.getsize(path)
+    targets = [size * i // shardCount for i in xrange(1, shardCount)]
+    with open(path, "rb") as f:
+        if quoteChar is None:
+            boundaries = [_nextNewline(f, target, size) for target in targets]
+        else:
+            boundaries = _quoteAwareBoundaries(f, targets, quoteChar, size)
+    offsets = sorted(set([0] + boundaries + [size]))
+    return [(start, end) for start, end in zip(offsets, offsets[1:])]
+
+def _nextNewline(f, offset, size):
+    """
+    (internal) Returns the offset just after the first newline at or after the offset, or size if not found
+    """
+    f.seek(offset)
+    f.readline()
+    return min(f.tell(), size)
+
+def _quoteAwareBoundaries(f, targets, quoteChar, size):
+    """
+    (internal) Returns row boundaries at or after the targets, scanning the file with the parity of quote characters
+    """
+    boundaries = []
+    pending = collections.deque(targets)
+    blockStart = 0
+    quoted = False
+    while pending:
+        block = f.read(SCAN_BLOCK_SIZE)
+        if not block:
+            break
+        position = 0
+        while pending and pending[0] < blockStart + len(block):
+            newline = block.find("\n", max(pending[0] - blockStart, position))
+            if newline < 0:
+                break
+            quoted ^= block.count(quoteChar, position, newline) % 2 == 1
+            position = newline + 1
+            if not quoted:
+                boundary = blockStart + position
+                while pending and pending[0] < boundary:
+                    pending.popleft()
+                boundaries.append(boundary)
+        quoted ^= block.count(quoteChar, position) % 2 == 1
+        blockStart += len(block)
+    boundaries.extend(size for _ in pending)
+    return boundaries
+
+def _rangeLines(f, start, end):
+    """
+    (internal) Generates lines of the file in the byte range
+    """
+    f.seek(start)
+    position = start
+    readline = f.readline
+    while position < end:
+        line = readline()
+        if not line:
+            return
+        position += len(line)
+        yield line
+
+def _columnsOf(rows):
+    """
+    (internal) Transposes rows into columns, rows may have different lengths
+    """
+    width = max(len(row) for row in rows)
+    if all(len(row) == width for row in rows):
+        return zip(*rows)
+    return [[row[i] for row in rows if len(row) > i] for i in xrange(width)]
+
+def _estimateRows(rows, estimators, chunkSize, earlyTermination):
+    """
+    (internal) Estimates columns of rows chunk by chunk.
+    If earlyTermination, settled columns are skipped, and rows are no longer read once all columns are settled.
+    
+    @return: a pair of (a list of EstimationContext objects, a list of numbers of checked values) of the columns
+    """
+    contexts = []
+    counts = []
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunkSize))
+        if not chunk:
+            break
+        chunk = [row for row in chunk if row]
+        if not chunk:
+            continue
+        for i, column in enumerate(_columnsOf(chunk)):
+            if i == len(contexts):
+                contexts.append(EstimationContext(estimators))
+                counts.append(0)
+            if earlyTermination and contexts[i].settled:
+                continue
+            contexts[i].updateMany(column, chunkSize)
+            counts[i] += len(column)
+        if earlyTermination and all(context.settled for context in contexts):
+            break
+    return contexts, counts
+
+def _estimateShard(path, start, end, estimatorsFactory, skipHeader, delimiter, quoteChar, chunkSize, earlyTermination, bufferSize):
+    """
+    (internal) Estimates columns of a byte range of the file, this function is performed in a worker process.
+    The range is streamed by ChunkedCSVReader, so memory use does not depend on the size of the range.
+    
+    @return: a tuple of (header row or None, a list of indices of surviving estimators of the columns, a list of numbers of checked values of the columns, bytes read)
+    """
+    estimators = estimatorsFactory()
+    reader = ChunkedCSVReader(path, start, end, bufferSize, delimiter, quoteChar)
+    rows = iter(reader)
+    header = next(rows, None) if skipHeader else None
+    contexts, counts = _estimateRows(rows, estimators, chunkSize, earlyTermination)
+    return header, [[estimators.index(e) for e in context.availables] for context in contexts], counts, reader.bytesRead
+
+def _mergeSurvivors(results):
+    """
+    (internal) Intersects surviving estimator indices and sums numbers of checked values of the shards column by column.
+    A column which a shard does not have is not constrained by the shard.
+    
+    @return: a pair of (a list of sets of indices, a list of numbers of checked values) of the columns
+    """
+    merged = []
+    counts = []
+    for _, survivors, checked, _ in results:
+        for i, (indices, count) in enumerate(itertools.izip(survivors, checked)):
+            if i == len(merged):
+                merged.append(set(indices))
+                counts.append(count)
+            else:
+                merged[i] &= set(indices)
+                counts[i] += count
+    return merged, counts
+
+def estimateSchema(path, estimatorsFactory = defaultEstimators, hasHeader = False, processes = None, shardSize = DEFAULT_SHARD_SIZE,
+                   delimiter = ",", quoteChar = '"', chunkSize = DEFAULT_UPDATE_CHUNK_SIZE, earlyTermination = False, sampling = None,
+                   bufferSize = DEFAULT_BUFFER_SIZE):
+    """
+    Estimates the schema of a CSV file in parallel.
+    With earlyTermination, feasible estimators of the found columns are the same as a full scan, but a column which appears only in rows after all columns are settled is not found.
+    
+    @param path: a path of the CSV file
+    @param estimatorsFactory: a module level(picklable) function which returns a sequence of ValueEstimators in order of preference
+    @param hasHeader: the first row is the column names if True
+    @param processes: number of worker processes, or multiprocessing.cpu_count() if None. The file is estimated in this process if 1.
+    @param shardSize: approximate bytes of a shard, the file is split into at least processes shards
+    @param delimiter: a delimiter character
+    @param quoteChar: a quote character, or None if fields are never quoted
+    @param chunkSize: number of rows which are estimated at once
+    @param earlyTermination: stops checking settled columns, and stops reading once all columns are settled if True
+    @param sampling: a Sampling object to estimate a sample of rows in this process, or None to estimate all rows
+    @param bufferSize: bytes of a chunk which is read at once
+    @return: EstimatedSchema object
+    """
+    processes = int(processes) if not processes is None else multiprocessing.cpu_count()
+    if processes <= 0:
+        raise ValueError("Processes must be more than 0")
+    if int(shardSize) <= 0:
+        raise ValueError("Shard size must be more than 0")
+    if not sampling is None:
+        header, rows, exhaustive = sampling.sample(path, hasHeader, readerArgs(delimiter, quoteChar))
+        contexts, counts = _estimateRows(rows, estimatorsFactory(), chunkSize, earlyTermination)
+        return EstimatedSchema(header, contexts, counts, exhaustive)
+    size = os.path.getsize(path)
+    if processes == 1:
+        results = [_estimateShard(path, 0, size, estimatorsFactory, hasHeader, delimiter, quoteChar, chunkSize, earlyTermination, bufferSize)]
+    else:
+        shardCount = max(processes, -(-size // int(shardSize)))
+        ranges = shardRanges(path, shardCount, quoteChar)
+        executor = ProcessExecutor(processes, chunkSize = 1)
+        try:
+            futures = [executor.submit(_estimateShard, path, start, end, estimatorsFactory, hasHeader and start == 0, delimiter, quoteChar, chunkSize, earlyTermination, bufferSize)
+                       for start, end in ranges]
+            results = [future.get() for future in futures]
+        finally:
+            executor.shutdown()
+    estimators = estimatorsFactory()
+    merged, counts = _mergeSurvivors(results)
+    contexts = [EstimationContext([e for i, e in enumerate(estimators) if i in indices]) for indices in merged]
+    names = results[0][0] if hasHeader and results else None
+    return EstimatedSchema(names, contexts, counts, True, sum(result[3] for result in results))
+
+if __name__ == "__main__":
+    import sys
+    import time
+    for path in sys.argv[1:]:
+        for sampling, earlyTermination in ((StratifiedSampling(), True), (None, True), (None, False)):
+            begin = time.time()
+            schema = estimateSchema(path, earlyTermination = earlyTermination, sampling = sampling)
+            print schema
+            print "%s(%s, earlyTermination=%s): %f sec, %s bytes read" % (path, sampling, earlyTermination, time.time() - begin, schema.bytesRead)
@@ -4,19 +4,40 @@ Created on 2016/02/09
 
 @author: _
 '''
-import sys
-from pyth2.fs.Path import Path
+import argparse
 import os
+import sys
+import time
+
+from pyth2.io.csv.ParallelSchemaEstimator import estimateSchema, HeadSampling, ReservoirSampling, StratifiedSampling, DEFAULT_SAMPLE_ROWS
+
+SAMPLINGS = {"head": HeadSampling, "reservoir": ReservoirSampling, "stratified": StratifiedSampling} # name -> type of Sampling
 
 def main(*args):
-    for fpath in map(Path, args[1:]):
+    """
+    Estimates schemas of CSV files which are given as arguments, and prints the schemas and the throughput
+    """
+    parser = argparse.ArgumentParser(prog = args[0], description = "Estimates column types of CSV files")
+    parser.add_argument("files", nargs = "+", help = "CSV files")
+    parser.add_argument("--header", action = "store_true", help = "the first row is the column names")
+    parser.add_argument("--processes", type = int, default = None, help = "number of worker processes(default: number of cores)")
+    parser.add_argument("--delimiter", default = ",", help = "delimiter character")
+    parser.add_argument("--sample", choices = sorted(SAMPLINGS), default = None, help = "estimates a sample of rows instead of all rows")
+    parser.add_argument("--rows", type = int, default = DEFAULT_SAMPLE_ROWS, help = "number of sampled rows")
+    options = parser.parse_args(args[1:])
+    for fpath in options.files:
         if not os.path.isfile(fpath):
             print "%s is not a file" % fpath
             continue
-        
-        
-    pass
+        sampling = SAMPLINGS[options.sample](options.rows) if not options.sample is None else None
+        begin = time.time()
+        schema = estimateSchema(fpath, hasHeader = options.header, processes = options.processes, delimiter = options.delimiter, sampling = sampling)
+        elapsed = time.time() - begin
+        print schema
+        if sampling is None:
+            print "%s: %f sec, %.1f MB/s" % (fpath, elapsed, schema.bytesRead / elapsed / 1e6 if elapsed else 0.0) # bytes actually read, not the file size
+        else:
+            print "%s: %f sec(%s)" % (fpath, elapsed, sampling)
 
 if __name__ == "__main__":
     main(*sys.argv)
-